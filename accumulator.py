@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+import numpy as np
+
+### SCAN AVERAGING ###
+
+# Running average of scans with Welford's variance. All the state lives in one
+# preallocated float64 buffer, so memory does not depend on the number of
+# scans and adding a scan does not allocate.
+class SpectrumAccumulator:
+  def __init__(self, pixels=2048):
+    self.pixels = pixels
+    self.count = 0
+    # rows: mean, sum of squared deviations (M2), two scratch rows
+    self._buffer = np.zeros((4, pixels), dtype=np.float64)
+
+  def reset(self):
+    self.count = 0
+    self._buffer[:] = 0.0
+
+  def add(self, scan):
+    mean, m2, delta, tmp = self._buffer
+    self.count += 1
+
+    np.subtract(scan, mean, out=delta)
+    np.divide(delta, self.count, out=tmp)
+    mean += tmp
+    np.subtract(scan, mean, out=tmp)
+    tmp *= delta
+    m2 += tmp
+
+  def mean(self):
+    return self._buffer[0].copy()
+
+  def sum(self):
+    return self._buffer[0] * self.count
+
+  # per-pixel sample variance of a single scan
+  def variance(self):
+    if self.count < 2:
+      return np.zeros(self.pixels)
+    return self._buffer[1] / (self.count - 1)
+
+  def std(self):
+    return np.sqrt(self.variance())
+
+  # signal to noise ratio of the averaged spectrum - the mean over its standard
+  # error, NaN where it cannot be estimated (a single scan or zero noise)
+  def snr(self):
+    stdError = self.std() / np.sqrt(max(self.count, 1))
+    return np.divide(
+      self._buffer[0],
+      stdError,
+      out=np.full(self.pixels, np.nan),
+      where=stdError > 0
+    )
+
+  # median signal to noise ratio over a window of pixels (slice), of the mean
+  # minus an optional background (dark spectrum of the window); 0 until it
+  # can be estimated. Pixels without noise (clipped) and those set in the
+  # boolean exclude array of the window are left out.
+  def windowSnr(self, window=slice(None), background=None, exclude=None):
+    if self.count < 2:
+      return 0.0
+    signal = self._buffer[0, window]
+    if background is not None:
+      signal = signal - background
+    stdError = np.sqrt(self._buffer[1, window] / (self.count - 1) / self.count)
+    valid = stdError > 0
+    if exclude is not None:
+      valid &= ~exclude
+    if not valid.any():
+      return 0.0
+    snr = np.divide(signal, stdError, out=np.full(len(signal), np.nan), where=valid)
+    return float(np.nanmedian(snr))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+import threading
+import queue
+
+### BACKGROUND ACQUISITION ###
+
+# Runs spectrometer jobs on a dedicated thread, so the Tk mainloop never blocks
+# on the device. A job is a callable job(progress, stopEvent) returning the
+# result. Messages are put on the thread-safe `results` queue as tuples:
+#   ('progress', tag, fraction)
+#   ('done', tag, result)
+#   ('cancelled', tag, None)
+#   ('error', tag, exception)
+# The GUI polls the queue with after(), because Tk widgets must only be touched
+# from the main thread.
+class AcquisitionWorker:
+  def __init__(self):
+    self.results = queue.Queue()
+    self._jobs = queue.Queue()
+    # stop events of the submitted jobs that have not finished yet
+    self._stopEvents = set()
+    self._pending = 0
+    self._lock = threading.Lock()
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def submit(self, tag, job):
+    stopEvent = threading.Event()
+    with self._lock:
+      self._pending += 1
+      self._stopEvents.add(stopEvent)
+    self._jobs.put((tag, job, stopEvent))
+
+  # cancels the running job and drops the ones still waiting; every job has
+  # its own stop event, so a job taken off the queue but not started yet is
+  # cancelled too
+  def cancel(self):
+    with self._lock:
+      for stopEvent in self._stopEvents:
+        stopEvent.set()
+    while True:
+      try:
+        item = self._jobs.get_nowait()
+      except queue.Empty:
+        break
+      if item is None:
+        self._jobs.put(None)
+        break
+      with self._lock:
+        self._pending -= 1
+        self._stopEvents.discard(item[2])
+      self.results.put(('cancelled', item[0], None))
+
+  def isBusy(self):
+    with self._lock:
+      return self._pending > 0
+
+  def stop(self):
+    self.cancel()
+    self._jobs.put(None)
+    self._thread.join()
+
+  def _run(self):
+    while True:
+      item = self._jobs.get()
+      if item is None:
+        break
+
+      tag, job, stopEvent = item
+      progress = lambda fraction: self.results.put(('progress', tag, fraction))
+
+      try:
+        result = job(progress, stopEvent)
+        if stopEvent.is_set():
+          message = ('cancelled', tag, None)
+        else:
+          message = ('done', tag, result)
+      except Exception as e:
+        message = ('error', tag, e)
+
+      # not busy any more by the time the GUI sees the final message
+      with self._lock:
+        self._pending -= 1
+        self._stopEvents.discard(stopEvent)
+      self.results.put(message)
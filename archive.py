@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+import os
+import time
+import numpy as np
+from read_files import *
+from metrics import metrics
+
+### BINARY SPECTRUM ARCHIVE ###
+
+# Append-only file of spectra sharing one wavelength axis. Layout:
+#   header       64 bytes, _HEADER_DTYPE
+#   wavelengths  pixels x float64
+#   records      each one metadata + pixels x float32/float64 intensities
+# The metadata of each record is the index of the archive. Records are read
+# through numpy.memmap, so a single spectrum or a range of wavelengths is
+# loaded without reading the whole file.
+
+ARCHIVE_MAGIC = b'WLICSPA1'
+ARCHIVE_VERSION = 1
+
+FLAG_CORRECT_DARK_COUNTS = 1
+FLAG_CORRECT_NONLINEARITY = 2
+
+_HEADER_DTYPE = np.dtype([
+  ('magic', 'S8'),
+  ('version', '<u4'),
+  ('pixels', '<u4'),
+  ('dtype', 'S8'),
+  ('reserved', 'u1', (40,))
+])
+
+def _recordDtype(pixels, dtype):
+  return np.dtype([
+    ('timestamp', '<f8'),
+    ('integrationTime', '<i8'),
+    ('scans', '<i4'),
+    ('boxcarWidth', '<i4'),
+    ('flags', '<u4'),
+    ('reserved', '<u4'),
+    ('ys', np.dtype(dtype).newbyteorder('<'), (pixels,))
+  ])
+
+class SpectrumArchive:
+  def __init__(self, filePath):
+    self.filePath = filePath
+    self._file = None
+    self._records = None
+
+    header = np.fromfile(filePath, dtype=_HEADER_DTYPE, count=1)
+    if len(header) == 0 or header['magic'][0] != ARCHIVE_MAGIC:
+      raise ValueError('not a spectrum archive: {0}'.format(filePath))
+    if header['version'][0] != ARCHIVE_VERSION:
+      raise ValueError('unsupported archive version {0}'.format(header['version'][0]))
+
+    self.pixels = int(header['pixels'][0])
+    self.dtype = np.dtype(header['dtype'][0].decode())
+    self.recordDtype = _recordDtype(self.pixels, self.dtype)
+    self.dataOffset = _HEADER_DTYPE.itemsize + self.pixels * 8
+
+    wavelengths = np.fromfile(filePath, dtype='<f8', count=self.pixels, offset=_HEADER_DTYPE.itemsize)
+    wavelengths.flags.writeable = False
+    self.wavelengths = wavelengths
+
+  @classmethod
+  def create(cls, filePath, wavelengths, dtype=np.float32):
+    wavelengths = np.asarray(wavelengths, dtype='<f8')
+
+    header = np.zeros(1, dtype=_HEADER_DTYPE)
+    header['magic'] = ARCHIVE_MAGIC
+    header['version'] = ARCHIVE_VERSION
+    header['pixels'] = len(wavelengths)
+    header['dtype'] = np.dtype(dtype).newbyteorder('<').str.encode()
+
+    with open(filePath, 'wb') as f:
+      f.write(header.tobytes())
+      f.write(wavelengths.tobytes())
+
+    return cls(filePath)
+
+  # opens an existing archive for appending or creates a new one with the
+  # given axis; an incomplete last record (interrupted write) is cut off, so
+  # new records are not written after its bytes
+  @classmethod
+  def open(cls, filePath, wavelengths=None, dtype=np.float32):
+    if os.path.exists(filePath):
+      archive = cls(filePath)
+      archive.truncateIncomplete()
+      return archive
+    if wavelengths is None:
+      raise ValueError('wavelengths are needed to create {0}'.format(filePath))
+    return cls.create(filePath, wavelengths, dtype)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def __len__(self):
+    # records appended through this object may still be buffered
+    self.flush()
+    # an incomplete last record (interrupted write) is ignored
+    size = os.path.getsize(self.filePath) - self.dataOffset
+    return max(size, 0) // self.recordDtype.itemsize
+
+  def __getitem__(self, index):
+    record = self.records()[index]
+    return {
+      'xs': self.wavelengths,
+      'ys': record['ys'],
+      'timestamp': float(record['timestamp']),
+      'integrationTime': int(record['integrationTime']),
+      'scans': int(record['scans']),
+      'boxcarWidth': int(record['boxcarWidth']),
+      'correctDarkCounts': bool(record['flags'] & FLAG_CORRECT_DARK_COUNTS),
+      'correctNonlinearity': bool(record['flags'] & FLAG_CORRECT_NONLINEARITY)
+    }
+
+  def append(self, spectrum, timestamp=None, integrationTime=0, scans=1, boxcarWidth=0, correctDarkCounts=False, correctNonlinearity=False):
+    self.appendMany(
+      np.asarray(spectrum['ys']).reshape(1, -1),
+      time.time() if timestamp is None else timestamp,
+      integrationTime,
+      scans,
+      boxcarWidth,
+      correctDarkCounts,
+      correctNonlinearity
+    )
+
+  # appends the rows of a 2-D intensity array, metadata can be a scalar or
+  # one value per row
+  def appendMany(self, intensities, timestamp=None, integrationTime=0, scans=1, boxcarWidth=0, correctDarkCounts=False, correctNonlinearity=False):
+    intensities = np.asarray(intensities)
+    if intensities.ndim != 2 or intensities.shape[1] != self.pixels:
+      raise ValueError('expected spectra with {0} pixels'.format(self.pixels))
+
+    records = np.zeros(len(intensities), dtype=self.recordDtype)
+    records['timestamp'] = time.time() if timestamp is None else timestamp
+    records['integrationTime'] = integrationTime
+    records['scans'] = scans
+    records['boxcarWidth'] = boxcarWidth
+    records['flags'] = np.where(correctDarkCounts, FLAG_CORRECT_DARK_COUNTS, 0) | np.where(correctNonlinearity, FLAG_CORRECT_NONLINEARITY, 0)
+    records['ys'] = intensities
+
+    with metrics.timer('fileWrite'):
+      if self._file is None:
+        self._file = open(self.filePath, 'ab')
+      self._file.write(records.tobytes())
+
+  def truncateIncomplete(self):
+    size = self.dataOffset + len(self) * self.recordDtype.itemsize
+    if os.path.getsize(self.filePath) > size:
+      self.close()
+      os.truncate(self.filePath, size)
+
+  def flush(self):
+    if self._file is not None:
+      self._file.flush()
+
+  def close(self):
+    if self._file is not None:
+      self._file.close()
+      self._file = None
+    self._records = None
+
+  # memory mapped view of all the records
+  def records(self):
+    self.flush()
+    count = len(self)
+    if self._records is None or len(self._records) != count:
+      if count == 0:
+        return np.zeros(0, dtype=self.recordDtype)
+      self._records = np.memmap(self.filePath, dtype=self.recordDtype, mode='r', offset=self.dataOffset, shape=(count,))
+    return self._records
+
+  # metadata of all the records, without the intensities
+  def index(self):
+    records = self.records()
+    return {name: np.array(records[name]) for name in self.recordDtype.names if name not in ('ys', 'reserved')}
+
+  def wavelengthSlice(self, wlMin=None, wlMax=None):
+    start = 0 if wlMin is None else int(np.searchsorted(self.wavelengths, wlMin, side='left'))
+    stop = self.pixels if wlMax is None else int(np.searchsorted(self.wavelengths, wlMax, side='right'))
+    return slice(start, stop)
+
+  # memory mapped intensities of the selected records and wavelength range
+  def intensities(self, rows=slice(None), wlMin=None, wlMax=None):
+    return self.records()['ys'][rows, self.wavelengthSlice(wlMin, wlMax)]
+
+  ## import/export ##
+
+  def importTextFile(self, filename, **metadata):
+    self._importSpectrum(readSpectrumFromTsvFile(filename), filename, metadata)
+
+  def importOceanViewFile(self, filename, **metadata):
+    self._importSpectrum(readSpectrumFromFile(filename), filename, metadata)
+
+  def _importSpectrum(self, spectrum, filename, metadata):
+    if len(spectrum['xs']) != self.pixels or not np.allclose(spectrum['xs'], self.wavelengths):
+      raise ValueError('wavelengths of {0} do not match the archive'.format(filename))
+    self.append(spectrum, **metadata)
+
+  def exportTextFile(self, index, filePath):
+    writeSpectrumToFile(self[index], filePath)
+
+  def exportOceanViewFile(self, index, filePath):
+    spectrum = self[index]
+    writeOceanViewFile(spectrum, filePath, spectrum)
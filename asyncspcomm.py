@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from spcomm import *
+
+### ASYNCIO SPECTROMETER COMMUNICATION ###
+
+# Awaitable wrapper of SpComm for use in an asyncio event loop next to other
+# instruments. The blocking USB calls run on a single thread per device, so
+# the loop is never blocked, and an asyncio.Lock keeps coroutines from
+# interleaving their commands: a read with its settings is one unit.
+#
+#   spectrometer = AsyncSpComm()
+#   await spectrometer.connectToDevice()
+#   await spectrometer.setIntegrationTime(20000)
+#   sp = await spectrometer.readSpectrumFromDevice(10)
+#   async for frame in spectrometer.frames(count=100):
+#     ...
+class AsyncSpComm:
+  def __init__(self, spectrometer=None):
+    self.spectrometer = SpComm() if spectrometer is None else spectrometer
+    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='spectrometer')
+    # created on first use, in the running loop
+    self._lock = None
+    # last integration time set through this object
+    self.integrationTime = None
+
+  @property
+  def wavelengths(self):
+    return self.spectrometer.wavelengths
+
+  def serialNumber(self):
+    return self.spectrometer.serialNumber()
+
+  def lock(self):
+    if self._lock is None:
+      self._lock = asyncio.Lock()
+    return self._lock
+
+  # runs function(*args) on the device thread
+  async def _run(self, function, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(self._executor, function, *args)
+
+  async def connectToDevice(self, device=None):
+    async with self.lock():
+      return await self._run(self.spectrometer.connectToDevice, device)
+
+  async def disconnect(self):
+    async with self.lock():
+      await self._run(self.spectrometer.disconnect)
+    self._executor.shutdown()
+
+  async def setIntegrationTime(self, integrationTime):
+    async with self.lock():
+      await self._run(self._setIntegrationTime, integrationTime)
+
+  # on the device thread, the device is only told about changes; the first
+  # spectrum after a change may still use the old setting, so one integration
+  # time passes before the next read
+  def _setIntegrationTime(self, integrationTime):
+    if integrationTime != self.integrationTime:
+      self.spectrometer.setIntegrationTime(integrationTime)
+      self.integrationTime = integrationTime
+      time.sleep(integrationTime / 1000000)
+
+  async def optimizeIntegrationTime(self, **options):
+    async with self.lock():
+      # the probes change the integration time behind the cache
+      self.integrationTime = None
+      return await self._run(lambda: self.spectrometer.optimizeIntegrationTime(**options))
+
+  # Same arguments and result as SpComm.readSpectrumFromDevice. The callback
+  # gets the progress in the event loop thread. When the coroutine is
+  # cancelled the read stops after the current scan. An integrationTime is set
+  # before the read without releasing the device in between.
+  async def readSpectrumFromDevice(self, scansToAverage=1, boxcarWidth=0, correctDarkCounts=False, correctNonlinearity=False, callback=None, integrationTime=None):
+    loop = asyncio.get_running_loop()
+    stopEvent = threading.Event()
+    progress = None
+    if callback is not None:
+      progress = lambda fraction: loop.call_soon_threadsafe(callback, fraction)
+
+    def read():
+      if integrationTime is not None:
+        self._setIntegrationTime(integrationTime)
+      return self.spectrometer.readSpectrumFromDevice(scansToAverage, boxcarWidth, correctDarkCounts, correctNonlinearity, progress, stopEvent)
+
+    async with self.lock():
+      future = loop.run_in_executor(self._executor, read)
+      try:
+        return await asyncio.shield(future)
+      except asyncio.CancelledError:
+        # keep the lock until the device is free again
+        stopEvent.set()
+        await asyncio.wait([future])
+        raise
+
+  # Async iterator of spectra read back to back, each with a 'timestamp'. With
+  # an interval (s) the reads start on a fixed schedule instead. The lock is
+  # taken per frame, so other coroutines can change settings in between.
+  async def frames(self, scansToAverage=1, boxcarWidth=0, correctDarkCounts=False, correctNonlinearity=False, interval=None, count=None, integrationTime=None):
+    n = 0
+    start = time.monotonic()
+    while count is None or n < count:
+      if interval is not None:
+        delay = start + n * interval - time.monotonic()
+        if delay > 0:
+          await asyncio.sleep(delay)
+      timestamp = time.time()
+      spectrum = await self.readSpectrumFromDevice(scansToAverage, boxcarWidth, correctDarkCounts, correctNonlinearity, integrationTime=integrationTime)
+      spectrum['timestamp'] = timestamp
+      n += 1
+      yield spectrum
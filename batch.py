@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+import os
+import csv
+import glob
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from read_files import *
+from irradiance import *
+from archive import SpectrumArchive
+from smoothing import boxcar
+
+### BATCH PROCESSING OF SPECTRUM FILES ###
+
+# settings shared by all files, set once per worker process by the pool
+# initializer instead of being sent with every file
+_context = None
+
+def _initWorker(context):
+  global _context
+  _context = context
+
+def expandFiles(patterns):
+  files = []
+  for pattern in patterns:
+    matches = sorted(glob.glob(pattern))
+    files.extend(matches if len(matches) > 0 else [pattern])
+  return files
+
+def parseRegion(text):
+  minLimit, maxLimit = text.split(':')
+  return {'min': float(minLimit), 'max': float(maxLimit)}
+
+# dark subtraction, boxcar smoothing and integration over the regions of one
+# file, runs in a worker process
+def processFile(filename):
+  context = _context
+  spectrum = readSpectrumFromFile(filename)
+  ys = spectrum['ys']
+
+  if context['darkYs'] is not None:
+    ys = ys - context['darkYs']
+
+  if context['boxcarWidth'] > 0:
+    ys = boxcar(ys, context['boxcarWidth'])
+
+  engine = context['engine']
+  if engine.calibration is not None:
+    # dark is already subtracted
+    values = engine.integrateRegions(engine.irradiance(ys, 0.0, context['integrationTime']), context['regions'])
+  else:
+    # integrated counts
+    values = engine.integrateRegions(ys, context['regions'])
+
+  return {
+    'file': filename,
+    'maxCounts': float(np.amax(spectrum['ys'])),
+    'regions': [float(value) for value in values],
+    'xs': spectrum['xs'] if context['keepSpectra'] else None,
+    'ys': ys if context['keepSpectra'] else None,
+    # settings of the file header, the given integration time and boxcar
+    # take precedence
+    'integrationTime': context['integrationTime'] or spectrum.get('integrationTime', 0),
+    'scans': spectrum.get('scans', 1),
+    'boxcarWidth': context['boxcarWidth'] or spectrum.get('boxcarWidth', 0),
+    'correctDarkCounts': spectrum.get('correctDarkCounts', False),
+    'correctNonlinearity': spectrum.get('correctNonlinearity', False)
+  }
+
+# processes files on a pool of worker processes, results are yielded in the
+# order of the files
+def processFiles(files, darkFile=None, boxcarWidth=0, regions=None, calibrationFile=None, integrationTime=None, collectionArea=1.0, keepSpectra=False, workers=None):
+  if len(files) == 0:
+    return
+
+  if calibrationFile is not None and integrationTime is None:
+    raise ValueError('integration time is needed for irradiance')
+
+  # the wavelength axis is the same for all files of one spectrometer
+  xs = readSpectrumFromFile(files[0])['xs']
+  context = {
+    'darkYs': readSpectrumFromFile(darkFile)['ys'] if darkFile is not None else None,
+    'boxcarWidth': boxcarWidth,
+    'regions': regions or [],
+    # calibration interpolated and bin widths calculated once for all files
+    'engine': IrradianceEngine(xs, loadCalibration(calibrationFile) if calibrationFile is not None else None, collectionArea),
+    'integrationTime': integrationTime,
+    'keepSpectra': keepSpectra
+  }
+
+  workers = workers or os.cpu_count()
+  # a few chunks per worker keeps all cores busy without per-file overhead
+  chunksize = max(1, len(files) // (workers * 4))
+
+  with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=(context,)) as executor:
+    for result in executor.map(processFile, files, chunksize=chunksize):
+      yield result
+
+def _summaryHeader(regions, calibrated):
+  unit = 'irradiance [uW/cm2]' if calibrated else 'counts'
+  return ['file', 'max counts'] + ['{0} {1}-{2} nm'.format(unit, region['min'], region['max']) for region in regions]
+
+def writeSummaryCsv(results, regions, filePath, calibrated):
+  with open(filePath, 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(_summaryHeader(regions, calibrated))
+    count = 0
+    for result in results:
+      writer.writerow([result['file'], result['maxCounts']] + result['regions'])
+      count += 1
+  return count
+
+# The processed spectra go to a new archive (an existing one is replaced, like
+# the CSV output), one record per file in the order of the files. The file
+# names and region values go to <filePath>.csv, with the record number of each
+# file.
+def writeSummaryArchive(results, regions, filePath, calibrated):
+  archive = None
+  count = 0
+  with open(filePath + '.csv', 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(['record'] + _summaryHeader(regions, calibrated))
+    for result in results:
+      if archive is None:
+        archive = SpectrumArchive.create(filePath, result['xs'])
+      elif len(result['xs']) != archive.pixels or not np.allclose(result['xs'], archive.wavelengths):
+        archive.close()
+        raise ValueError('wavelengths of {0} do not match the archive'.format(result['file']))
+      archive.append(
+        {'ys': result['ys']},
+        integrationTime=result['integrationTime'],
+        scans=result['scans'],
+        boxcarWidth=result['boxcarWidth'],
+        correctDarkCounts=result['correctDarkCounts'],
+        correctNonlinearity=result['correctNonlinearity']
+      )
+      writer.writerow([count, result['file'], result['maxCounts']] + result['regions'])
+      count += 1
+  if archive is not None:
+    archive.close()
+  return count
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+## Benchmarks of the hot paths: file parsing and writing, scan averaging and
+## boxcar, wavelength calculation and irradiance, over realistic sizes.
+## Results are saved as JSON and compared against a stored baseline.
+## Run: python benchmark.py --help
+##      python benchmark.py --legacy   (vectorized vs line by line readers)
+##      python benchmark.py --check    (pixel masks on a simulated device)
+
+import os
+import sys
+import json
+import time
+import timeit
+import platform
+import argparse
+import tempfile
+import numpy as np
+from read_files import *
+from archive import SpectrumArchive
+from accumulator import SpectrumAccumulator
+from smoothing import boxcar
+from irradiance import IrradianceEngine
+import spcomm
+from simulator import SimulatedSpectrometer
+from masks import MASK_SATURATED
+
+# previous, line by line implementation, kept for comparison
+def readSpectrumFromFileLines(filename):
+  file = open(filename, mode='r')
+  lines = file.readlines()
+  file.close()
+
+  xs = []
+  ys = []
+
+  insideData = False
+
+  for i in range (0, len(lines)):
+    if lines[i].startswith('>>>>>End'):
+      insideData = False
+      break
+
+    if lines[i].startswith('>>>>>Begin'):
+      insideData = True
+      continue
+
+    if insideData:
+      line = lines[i].rstrip('\r\n').replace(',', '.').split("\t")
+      xs.append(float(line[0]))
+      ys.append(float(line[1]))
+
+  return {'xs': xs, 'ys': ys}
+
+def readCalibrationFileLines(filename):
+  file = open(filename, mode='r')
+  lines = file.readlines()
+  file.close()
+
+  xs = []
+  ys = []
+
+  for i in range (9, len(lines)):
+    line = lines[i].rstrip('\r\n').split("\t")
+    xs.append(float(line[0]))
+    ys.append(float(line[1]))
+
+  return {'xs': xs, 'ys': ys}
+
+def writeOceanViewLikeFile(filePath, pixels=2048, commaDecimal=True):
+  xs = np.linspace(177.4, 880.0, pixels)
+  ys = np.random.default_rng(0).uniform(500., 50000., pixels)
+
+  lines = ['Data from benchmark', 'Spectrometer: USB2F01701', 'Number of Pixels in Spectrum: {0}'.format(pixels), '>>>>>Begin Spectral Data<<<<<']
+  for x, y in zip(xs, ys):
+    line = '{0:.3f}\t{1:.2f}'.format(x, y)
+    if commaDecimal:
+      line = line.replace('.', ',')
+    lines.append(line)
+  lines.append('>>>>>End Spectral Data<<<<<')
+
+  with open(filePath, 'w') as f:
+    f.write('\n'.join(lines) + '\n')
+
+def writeCalibrationLikeFile(filePath, pixels=2048):
+  xs = np.linspace(177.4, 880.0, pixels)
+  ys = np.random.default_rng(0).uniform(1e-6, 1e-4, pixels)
+
+  lines = ['header line {0}'.format(i) for i in range(0, 9)]
+  lines.extend(['{0:.3f}\t{1:.6E}'.format(x, y) for x, y in zip(xs, ys)])
+
+  with open(filePath, 'w') as f:
+    f.write('\n'.join(lines) + '\n')
+
+def compare(name, old, new, repeat=5, number=20):
+  tOld = min(timeit.repeat(old, repeat=repeat, number=number)) / number
+  tNew = min(timeit.repeat(new, repeat=repeat, number=number)) / number
+  print('{0:28s} lines {1:8.3f} ms   vectorized {2:8.3f} ms   speedup {3:5.1f}x'.format(name, tOld*1000, tNew*1000, tOld/tNew))
+
+def benchmarkReadFiles():
+  with tempfile.TemporaryDirectory() as dir:
+    spFilename = os.path.join(dir, 'spectrum.txt')
+    calFilename = os.path.join(dir, 'calibration.IrradCal')
+    writeOceanViewLikeFile(spFilename)
+    writeCalibrationLikeFile(calFilename)
+
+    # both must give the same numbers
+    assert np.allclose(readSpectrumFromFileLines(spFilename)['ys'], readSpectrumFromFile(spFilename)['ys'])
+    assert np.allclose(readCalibrationFileLines(calFilename)['ys'], readCalibrationFile(calFilename)['ys'])
+
+    compare('readSpectrumFromFile', lambda: readSpectrumFromFileLines(spFilename), lambda: readSpectrumFromFile(spFilename))
+    compare('readCalibrationFile', lambda: readCalibrationFileLines(calFilename), lambda: readCalibrationFile(calFilename))
+
+# a simulated device driven into saturation must be flagged with and without
+# the electric dark correction
+def checkSaturation():
+  for correctDarkCounts in [False, True]:
+    spectrometer = spcomm.SpComm()
+    spectrometer.attachSpectrometer(SimulatedSpectrometer(realtime=False, seed=0))
+    spectrometer.setIntegrationTime(1000000)
+    spectrum = spectrometer.readSpectrumFromDevice(2, 0, correctDarkCounts, False, rejectSaturated=True)
+    assert spectrum['saturated'] and spectrum['rejected'], 'saturation not detected (correctDarkCounts={0})'.format(correctDarkCounts)
+    assert (spectrum['mask'] & MASK_SATURATED).any()
+    print('saturation with correctDarkCounts={0}: {1} pixels flagged'.format(correctDarkCounts, int(np.count_nonzero(spectrum['mask'] & MASK_SATURATED))))
+
+## benchmark suite ##
+
+# Every case takes a size and a temporary directory and returns the function
+# to time. Sizes are numbers of spectra or of scans.
+
+def caseReadSpectrumFiles(size, dir):
+  files = [os.path.join(dir, 'read_{0}.txt'.format(i)) for i in range(0, size)]
+  for filename in files:
+    writeOceanViewLikeFile(filename)
+  return lambda: [readSpectrumFromFile(filename) for filename in files]
+
+def caseReadCalibrationFile(size, dir):
+  filename = os.path.join(dir, 'calibration.IrradCal')
+  writeCalibrationLikeFile(filename)
+  return lambda: [readCalibrationFile(filename) for i in range(0, size)]
+
+def caseWriteSpectrumFiles(size, dir):
+  spectrum = {'xs': np.linspace(177.4, 880.0, 2048), 'ys': np.random.default_rng(0).uniform(500., 50000., 2048)}
+  files = [os.path.join(dir, 'write_{0}.txt'.format(i)) for i in range(0, size)]
+  return lambda: [writeSpectrumToFile(spectrum, filename) for filename in files]
+
+def caseArchiveAppend(size, dir):
+  filename = os.path.join(dir, 'archive.wlic')
+  ys = np.random.default_rng(0).uniform(500., 50000., (size, 2048))
+  def run():
+    if os.path.exists(filename):
+      os.remove(filename)
+    with SpectrumArchive.create(filename, np.linspace(177.4, 880.0, 2048)) as archive:
+      for row in ys:
+        archive.append({'ys': row})
+  return run
+
+def caseAveraging(size, dir):
+  scans = np.random.default_rng(0).uniform(500., 50000., (16, 2048))
+  def run():
+    accumulator = SpectrumAccumulator(2048)
+    for i in range(0, size):
+      accumulator.add(scans[i % len(scans)])
+    return accumulator.mean(), accumulator.std(), accumulator.snr()
+  return run
+
+def caseBoxcar(size, dir):
+  ys = np.random.default_rng(0).uniform(500., 50000., (size, 2048))
+  return lambda: boxcar(ys, 10)
+
+# the whole readSpectrumFromDevice on a simulated device without frame timing
+def caseReadSpectrumFromDevice(size, dir):
+  spectrometer = spcomm.SpComm()
+  spectrometer.attachSpectrometer(SimulatedSpectrometer(realtime=False, seed=0))
+  return lambda: spectrometer.readSpectrumFromDevice(size, 2)
+
+def caseCalculateWavelengths(size, dir):
+  spectrometer = spcomm.SpComm()
+  def run():
+    for i in range(0, size):
+      spcomm._wavelengthCache.clear()
+      spectrometer.calculateWavelengths()
+  return run
+
+def caseIrradiance(size, dir):
+  xs = np.linspace(177.4, 880.0, 2048)
+  calibration = {'xs': xs, 'ys': np.full(2048, 1e-5)}
+  light = np.random.default_rng(0).uniform(500., 50000., (size, 2048))
+  dark = np.full(2048, 1500.)
+  regions = [{'min': wl, 'max': wl + 50.} for wl in range(200, 850, 65)]
+  engine = IrradianceEngine(xs, calibration, 0.4)
+  return lambda: engine.integrateRegions(engine.irradiance(light, dark, 20000), regions)
+
+SPECTRA_SIZES = {'quick': [1, 100], 'default': [1, 100, 1000], 'full': [1, 100, 1000, 10000]}
+SCAN_SIZES = {'quick': [1, 10, 100], 'default': [1, 10, 100, 1000], 'full': [1, 10, 100, 1000]}
+
+CASES = [
+  ('readSpectrumFromFile', caseReadSpectrumFiles, SPECTRA_SIZES),
+  ('readCalibrationFile', caseReadCalibrationFile, SPECTRA_SIZES),
+  ('writeSpectrumToFile', caseWriteSpectrumFiles, SPECTRA_SIZES),
+  ('archiveAppend', caseArchiveAppend, SPECTRA_SIZES),
+  ('averaging', caseAveraging, SCAN_SIZES),
+  ('boxcar', caseBoxcar, SPECTRA_SIZES),
+  ('readSpectrumFromDevice', caseReadSpectrumFromDevice, SCAN_SIZES),
+  ('calculateWavelengths', caseCalculateWavelengths, SPECTRA_SIZES),
+  ('irradiance', caseIrradiance, SPECTRA_SIZES)
+]
+
+# best time of `repeat` runs, each long enough to be measurable
+def measure(function, repeat=3):
+  timer = timeit.Timer(function)
+  number, total = timer.autorange()
+  times = [total / number] + [t / number for t in timer.repeat(repeat=repeat - 1, number=number)]
+  return min(times)
+
+def runSuite(sizes='default', only=None, repeat=3):
+  results = {}
+  for name, case, caseSizes in CASES:
+    if only and name not in only:
+      continue
+    for size in caseSizes[sizes]:
+      with tempfile.TemporaryDirectory() as dir:
+        seconds = measure(case(size, dir), repeat)
+      key = '{0}[{1}]'.format(name, size)
+      results[key] = {'case': name, 'size': size, 'seconds': seconds}
+      print('{0:36s} {1:12.3f} ms'.format(key, seconds*1000))
+  return {
+    'meta': {
+      'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'python': platform.python_version(),
+      'numpy': np.__version__,
+      'machine': platform.platform()
+    },
+    'results': results
+  }
+
+# cases more than `tolerance` slower than the baseline
+def compareWithBaseline(results, baseline, tolerance):
+  regressions = []
+  for key, result in results['results'].items():
+    if key not in baseline['results']:
+      continue
+    ratio = result['seconds'] / baseline['results'][key]['seconds']
+    marker = 'REGRESSION' if ratio > 1 + tolerance else ''
+    print('{0:36s} {1:6.2f}x baseline {2}'.format(key, ratio, marker))
+    if ratio > 1 + tolerance:
+      regressions.append(key)
+  return regressions
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='WLIC benchmarks')
+  parser.add_argument('--sizes', choices=list(SPECTRA_SIZES), default='default', help='problem sizes (full goes up to 10000 spectra)')
+  parser.add_argument('--case', action='append', help='run only this case, can be repeated')
+  parser.add_argument('--repeat', type=int, default=3, help='repetitions per case')
+  parser.add_argument('-o', '--output', help='save the results as JSON')
+  parser.add_argument('-b', '--baseline', help='compare with results saved before')
+  parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against the baseline (0.2 = 20%%)')
+  parser.add_argument('--legacy', action='store_true', help='compare the file readers with line by line parsing')
+  parser.add_argument('--check', action='store_true', help='check the pixel masks on a simulated device')
+  args = parser.parse_args(argv)
+
+  if args.legacy:
+    benchmarkReadFiles()
+    return 0
+  if args.check:
+    checkSaturation()
+    return 0
+
+  results = runSuite(args.sizes, args.case, args.repeat)
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=2)
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    regressions = compareWithBaseline(results, baseline, args.tolerance)
+    if len(regressions) > 0:
+      print('{0} regressions'.format(len(regressions)))
+      return 1
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+import os
+import glob
+import threading
+from collections import OrderedDict
+import numpy as np
+from read_files import readSpectrumFromFile, readSpectrumFromTsvFile
+from archive import SpectrumArchive
+
+### LAZY SPECTRUM COLLECTIONS ###
+
+# OceanView file, or a two column file as written by writeSpectrumToFile
+def readAnySpectrumFile(filename):
+  spectrum = readSpectrumFromFile(filename)
+  if len(spectrum['ys']) == 0:
+    spectrum = readSpectrumFromTsvFile(filename)
+  return spectrum
+
+# Many spectra on one wavelength axis seen as a (spectra x pixels) array that
+# is loaded only where it is used. The spectra are loaded in chunks of
+# chunkSize rows into float arrays; the last cacheChunks used chunks are kept
+# (least recently used are dropped), so memory stays bounded however large the
+# collection is.
+#
+#   collection = SpectrumCollection.fromFiles(['data/*.txt'])
+#   collection[10]                  # one spectrum (1-D)
+#   collection[100:200]             # rows 100-199 (2-D)
+#   collection.select(rows, 400, 500)  # rows between 400 and 500 nm
+#   for start, ys in collection.batches(1000): ...
+class SpectrumCollection:
+  def __init__(self, wavelengths, count, loadRows, names=None, chunkSize=256, cacheChunks=8, dtype=np.float64):
+    self.wavelengths = np.array(wavelengths, dtype=np.float64)
+    self.wavelengths.flags.writeable = False
+    self.count = count
+    # loadRows(start, stop) returns the rows as a 2-D array on the wavelength axis
+    self._loadRows = loadRows
+    self.names = names
+    self.chunkSize = chunkSize
+    self.cacheChunks = cacheChunks
+    self.dtype = np.dtype(dtype)
+    self._chunks = OrderedDict()
+    self._lock = threading.Lock()
+
+  # files by glob patterns or directories (all the .txt files in them);
+  # spectra with other wavelengths are interpolated to the axis of the first
+  # file
+  @classmethod
+  def fromFiles(cls, patterns, reader=readAnySpectrumFile, chunkSize=256, cacheChunks=8, dtype=np.float64, extension='.txt'):
+    if isinstance(patterns, str):
+      patterns = [patterns]
+    files = []
+    for pattern in patterns:
+      matches = sorted(glob.glob(pattern))
+      for match in (matches if len(matches) > 0 else [pattern]):
+        if os.path.isdir(match):
+          files.extend(sorted(glob.glob(os.path.join(match, '*' + extension))))
+        else:
+          files.append(match)
+    if len(files) == 0:
+      raise ValueError('no spectrum files')
+
+    wavelengths = np.asarray(reader(files[0])['xs'], dtype=np.float64)
+
+    def loadRows(start, stop):
+      rows = np.empty((stop - start, len(wavelengths)), dtype=dtype)
+      for i in range(start, stop):
+        spectrum = reader(files[i])
+        xs = np.asarray(spectrum['xs'])
+        if len(xs) == len(wavelengths) and np.array_equal(xs, wavelengths):
+          rows[i - start] = spectrum['ys']
+        else:
+          rows[i - start] = np.interp(wavelengths, xs, spectrum['ys'])
+      return rows
+
+    return cls(wavelengths, len(files), loadRows, files, chunkSize, cacheChunks, dtype)
+
+  # records of a SpectrumArchive (or the path of one)
+  @classmethod
+  def fromArchive(cls, archive, chunkSize=1024, cacheChunks=8, dtype=np.float64):
+    if isinstance(archive, str):
+      archive = SpectrumArchive(archive)
+
+    def loadRows(start, stop):
+      return np.array(archive.intensities(slice(start, stop)), dtype=dtype)
+
+    return cls(archive.wavelengths, len(archive), loadRows, None, chunkSize, cacheChunks, dtype)
+
+  def __len__(self):
+    return self.count
+
+  @property
+  def shape(self):
+    return (self.count, len(self.wavelengths))
+
+  def wavelengthSlice(self, wlMin=None, wlMax=None):
+    start = 0 if wlMin is None else int(np.searchsorted(self.wavelengths, wlMin, side='left'))
+    stop = len(self.wavelengths) if wlMax is None else int(np.searchsorted(self.wavelengths, wlMax, side='right'))
+    return slice(start, stop)
+
+  # rows of the chunk, loaded or from the cache (read-only)
+  def chunk(self, index):
+    with self._lock:
+      if index in self._chunks:
+        self._chunks.move_to_end(index)
+        return self._chunks[index]
+
+    start = index * self.chunkSize
+    rows = self._loadRows(start, min(start + self.chunkSize, self.count))
+    rows.flags.writeable = False
+
+    with self._lock:
+      self._chunks[index] = rows
+      while len(self._chunks) > self.cacheChunks:
+        self._chunks.popitem(last=False)
+    return rows
+
+  def clearCache(self):
+    with self._lock:
+      self._chunks.clear()
+
+  # 2-D array of the rows and pixel columns (int, slice or index array); an
+  # int drops its dimension like in numpy
+  def _take(self, rows, columns):
+    indices = np.arange(0, self.count)[rows]
+    single = indices.ndim == 0
+    indices = np.atleast_1d(indices)
+    pixels = np.arange(0, len(self.wavelengths))[columns]
+    singlePixel = pixels.ndim == 0
+    pixels = np.atleast_1d(pixels)
+    out = np.empty((len(indices), len(pixels)), dtype=self.dtype)
+    # a slice is a view of the chunk, no index array needed
+    if isinstance(columns, slice):
+      pixels = columns
+
+    chunks = indices // self.chunkSize
+    for index in np.unique(chunks):
+      selected = chunks == index
+      out[selected] = self.chunk(index)[indices[selected] - index * self.chunkSize][:, pixels]
+    if singlePixel:
+      out = out[:, 0]
+    return out[0] if single else out
+
+  # collection[rows] or collection[rows, columns], always a new array
+  def __getitem__(self, key):
+    if isinstance(key, tuple):
+      rows, columns = key
+    else:
+      rows, columns = key, slice(None)
+    return self._take(rows, columns)
+
+  # rows within a wavelength range, {'xs', 'ys'} like a spectrum (ys 1-D or 2-D)
+  def select(self, rows=slice(None), wlMin=None, wlMax=None):
+    columns = self.wavelengthSlice(wlMin, wlMax)
+    return {'xs': self.wavelengths[columns], 'ys': self._take(rows, columns)}
+
+  # (first row, ys) of consecutive batches of size rows
+  def batches(self, size, wlMin=None, wlMax=None):
+    columns = self.wavelengthSlice(wlMin, wlMax)
+    for start in range(0, self.count, size):
+      yield start, self._take(slice(start, start + size), columns)
+
+  def __array__(self, dtype=None, copy=None):
+    array = self._take(slice(None), slice(None))
+    return array if dtype is None else array.astype(dtype)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+### DARK SPECTRUM LIBRARY ###
+
+# Dark spectra keyed by device serial, integration time, scans and correction
+# flags. The least recently used spectra are evicted above maxEntries, spectra
+# older than ttl seconds are not used. For an integration time without its own
+# dark, one is interpolated linearly between the nearest shorter and longer
+# integration times with the same scans and corrections (dark counts grow
+# linearly with time). The pixel mask of a dark (hot pixels) is kept with it.
+# The library is kept in a .npz file if filePath is given; one that cannot be
+# read is replaced by an empty library.
+class DarkLibrary:
+  def __init__(self, filePath=None, maxEntries=64, ttl=3600.):
+    self.filePath = filePath
+    self.maxEntries = maxEntries
+    self.ttl = ttl
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+    if filePath is not None and os.path.exists(filePath):
+      self.load()
+
+  @staticmethod
+  def key(serial, integrationTime, scansToAverage, correctDarkCounts, correctNonlinearity):
+    return (str(serial), int(integrationTime), int(scansToAverage), bool(correctDarkCounts), bool(correctNonlinearity))
+
+  def __len__(self):
+    return len(self._entries)
+
+  def store(self, serial, integrationTime, scansToAverage, correctDarkCounts, correctNonlinearity, ys, timestamp=None, mask=None):
+    key = self.key(serial, integrationTime, scansToAverage, correctDarkCounts, correctNonlinearity)
+    with self._lock:
+      self._entries[key] = {
+        'ys': np.array(ys, dtype=np.float64),
+        'mask': None if mask is None else np.array(mask, dtype=np.uint8),
+        'timestamp': time.time() if timestamp is None else timestamp
+      }
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.maxEntries:
+        self._entries.popitem(last=False)
+
+    if self.filePath is not None:
+      self.save()
+
+  # dark for the settings as {'ys', 'integrationTime', 'interpolated'} or
+  # None, with 'mask' if the dark had one (of both darks interpolated from)
+  def lookup(self, serial, integrationTime, scansToAverage, correctDarkCounts, correctNonlinearity, interpolate=True):
+    key = self.key(serial, integrationTime, scansToAverage, correctDarkCounts, correctNonlinearity)
+    with self._lock:
+      self._expire()
+
+      if key in self._entries:
+        self._entries.move_to_end(key)
+        return self._dark(self._entries[key]['ys'], [self._entries[key]], key[1], False)
+
+      if not interpolate:
+        return None
+
+      # the same device, scans and corrections
+      shorter = None
+      longer = None
+      for other in self._entries:
+        if other[0] != key[0] or other[2:] != key[2:]:
+          continue
+        if other[1] < key[1] and (shorter is None or other[1] > shorter[1]):
+          shorter = other
+        elif other[1] > key[1] and (longer is None or other[1] < longer[1]):
+          longer = other
+
+      if shorter is None or longer is None:
+        return None
+
+      self._entries.move_to_end(shorter)
+      self._entries.move_to_end(longer)
+      fraction = (key[1] - shorter[1]) / (longer[1] - shorter[1])
+      ys = (1 - fraction) * self._entries[shorter]['ys'] + fraction * self._entries[longer]['ys']
+      return self._dark(ys, [self._entries[shorter], self._entries[longer]], key[1], True)
+
+  @staticmethod
+  def _dark(ys, entries, integrationTime, interpolated):
+    dark = {'ys': ys, 'integrationTime': integrationTime, 'interpolated': interpolated}
+    masks = [entry['mask'] for entry in entries if entry.get('mask') is not None]
+    if len(masks) > 0:
+      dark['mask'] = np.bitwise_or.reduce(masks)
+    return dark
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+  def _expire(self):
+    oldest = time.time() - self.ttl
+    for key in [key for key, entry in self._entries.items() if entry['timestamp'] < oldest]:
+      del self._entries[key]
+
+  def save(self):
+    with self._lock:
+      index = [{'key': list(key), 'timestamp': entry['timestamp']} for key, entry in self._entries.items()]
+      arrays = {'dark{0}'.format(i): entry['ys'] for i, entry in enumerate(self._entries.values())}
+      arrays.update({'mask{0}'.format(i): entry['mask'] for i, entry in enumerate(self._entries.values()) if entry.get('mask') is not None})
+
+    directory = os.path.dirname(self.filePath)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    with open(self.filePath, 'wb') as f:
+      np.savez(f, index=np.array(json.dumps(index)), **arrays)
+
+  # a corrupt or old file is not fatal, the library starts empty
+  def load(self):
+    try:
+      with np.load(self.filePath) as data:
+        index = json.loads(str(data['index']))
+        entries = OrderedDict()
+        for i, item in enumerate(index):
+          mask = 'mask{0}'.format(i)
+          entries[tuple(item['key'])] = {
+            'ys': data['dark{0}'.format(i)],
+            'mask': data[mask] if mask in data else None,
+            'timestamp': item['timestamp']
+          }
+    except Exception as e:
+      log.warning('dark library %s not loaded: %s', self.filePath, e)
+      entries = OrderedDict()
+
+    with self._lock:
+      self._entries = entries
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from seabreeze.spectrometers import list_devices
+from spcomm import *
+
+### MULTIPLE SPECTROMETERS ###
+
+# Opens all connected spectrometers, keyed by serial number. Each device is
+# read on its own thread, so acquisition on all of them takes as long as the
+# slowest one.
+class DeviceManager:
+  def __init__(self):
+    self.devices = {}
+    self._executor = None
+
+  def connectAll(self):
+    for device in list_devices():
+      spectrometer = SpComm()
+      spectrometer.connectToDevice(device)
+      self.devices[spectrometer.serialNumber()] = spectrometer
+
+    if len(self.devices) > 0:
+      self._executor = ThreadPoolExecutor(max_workers=len(self.devices), thread_name_prefix='spectrometer')
+    return list(self.devices)
+
+  def disconnectAll(self):
+    if self._executor is not None:
+      self._executor.shutdown()
+      self._executor = None
+    for spectrometer in self.devices.values():
+      spectrometer.disconnect()
+    self.devices = {}
+
+  def serials(self):
+    return list(self.devices)
+
+  # integrationTime is one value for all devices or a dict serial -> value
+  def setIntegrationTime(self, integrationTime):
+    for serial, spectrometer in self.devices.items():
+      if isinstance(integrationTime, dict):
+        if serial not in integrationTime:
+          continue
+        spectrometer.setIntegrationTime(integrationTime[serial])
+      else:
+        spectrometer.setIntegrationTime(integrationTime)
+
+  # starts acquisition on all (or the selected) devices at the same moment and
+  # returns a dict serial -> spectrum, with 'timestamp' (start) and
+  # 'endTimestamp' of the acquisition on each device; a device that fails
+  # gets {'error': exception} and does not affect the others. timeout (s)
+  # limits the wait for the other devices to be ready.
+  def triggerAll(self, scansToAverage=1, boxcarWidth=0, correctDarkCounts=False, correctNonlinearity=False, serials=None, timeout=None):
+    # once each, the barrier counts one thread per serial
+    serials = self.serials() if serials is None else list(dict.fromkeys(serials))
+    if len(serials) == 0:
+      return {}
+    unknown = [serial for serial in serials if serial not in self.devices]
+    if len(unknown) > 0:
+      raise ValueError('unknown spectrometers: {0}'.format(', '.join([str(serial) for serial in unknown])))
+
+    # all threads are released together once every one of them is ready
+    barrier = threading.Barrier(len(serials), timeout=timeout)
+
+    def acquire(spectrometer):
+      barrier.wait()
+      start = time.time()
+      spectrum = spectrometer.readSpectrumFromDevice(scansToAverage, boxcarWidth, correctDarkCounts, correctNonlinearity)
+      spectrum['timestamp'] = start
+      spectrum['endTimestamp'] = time.time()
+      return spectrum
+
+    futures = {}
+    try:
+      for serial in serials:
+        futures[serial] = self._executor.submit(acquire, self.devices[serial])
+    except Exception:
+      # the submitted ones would wait for the rest forever
+      barrier.abort()
+      raise
+
+    spectra = {}
+    for serial, future in futures.items():
+      try:
+        spectra[serial] = future.result()
+      except Exception as e:
+        spectra[serial] = {'error': e}
+    return spectra
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+import numpy as np
+from smoothing import boxcar
+from irradiance import calcWlWidths
+
+### PEAKS AND SPECTRAL FEATURES ###
+
+# All the functions work on 1-D spectra or 2-D arrays with one spectrum per
+# row, along the last axis, without Python loops over pixels or peaks. Peak
+# features are:
+#   pixel     index of the highest pixel
+#   position  sub-pixel centre in nm (parabola through the top three pixels)
+#   height    above the baseline, at the centre of the parabola
+#   fwhm      full width at half height in nm, interpolated between pixels;
+#             NaN if the peak does not fall to half within maxWidth pixels
+#   area      above the baseline between the points where the peak meets it,
+#             in counts*nm (or the units of ys times nm)
+
+# Rolling maximum or minimum (function np.maximum or np.minimum) over 2*width+1
+# pixels, with the edge values repeated. Van Herk/Gil-Werman: running extremes
+# forward and backward within blocks of the window length, so it is O(n)
+# whatever the width.
+def _rollingExtreme(ys, width, function):
+  ys = np.asarray(ys, dtype=np.float64)
+  if width <= 0:
+    return ys.copy()
+
+  window = 2*width + 1
+  n = ys.shape[-1]
+  length = -(-(n + 2*width) // window) * window
+  padded = np.pad(ys, [(0, 0)] * (ys.ndim - 1) + [(width, length - n - width)], mode='edge')
+  blocks = padded.reshape(ys.shape[:-1] + (length // window, window))
+  forward = function.accumulate(blocks, axis=-1).reshape(padded.shape)
+  backward = function.accumulate(blocks[..., ::-1], axis=-1)[..., ::-1].reshape(padded.shape)
+  return function(backward[..., :n], forward[..., window - 1:window - 1 + n])
+
+# Baseline under peaks narrower than 2*width+1 pixels: rolling minimum, then
+# rolling maximum of it (removes the peaks but follows the background), then a
+# boxcar of the same width to smooth the steps.
+def estimateBaseline(ys, width=50):
+  opened = _rollingExtreme(_rollingExtreme(ys, width, np.minimum), width, np.maximum)
+  return np.minimum(boxcar(opened, width), ys)
+
+# noise of every spectrum from the median absolute difference of neighbouring
+# pixels, robust against peaks
+def estimateNoise(ys):
+  ys = np.asarray(ys, dtype=np.float64)
+  return 1.4826 * np.median(np.abs(np.diff(ys, axis=-1)), axis=-1) / np.sqrt(2)
+
+# Local maxima of the baseline corrected ys higher than minHeight (by default
+# 5 times the noise of each spectrum) and the highest within distance pixels.
+# Returns (rows, pixels) index arrays; rows are all 0 for a 1-D spectrum.
+def findPeaks(corrected, minHeight=None, distance=3):
+  corrected = np.atleast_2d(np.asarray(corrected, dtype=np.float64))
+  if minHeight is None:
+    minHeight = 5 * estimateNoise(corrected)
+  threshold = np.broadcast_to(np.asarray(minHeight, dtype=np.float64), corrected.shape[:-1])[:, None]
+
+  peaks = (corrected == _rollingExtreme(corrected, max(distance, 1), np.maximum)) & (corrected > threshold)
+  # only the first pixel of a flat top
+  peaks[:, 1:] &= corrected[:, 1:] > corrected[:, :-1]
+  return np.nonzero(peaks)
+
+# features of the peaks at (rows, pixels) of the 2-D corrected ys, each peak
+# is examined within maxWidth pixels to either side
+def peakProperties(xs, corrected, rows, pixels, maxWidth=50, wlWidths=None):
+  xs = np.asarray(xs, dtype=np.float64)
+  corrected = np.atleast_2d(np.asarray(corrected, dtype=np.float64))
+  rows = np.asarray(rows, dtype=np.intp)
+  pixels = np.asarray(pixels, dtype=np.intp)
+  wlWidths = calcWlWidths(xs) if wlWidths is None else wlWidths
+  n = corrected.shape[-1]
+  pixelAxis = np.arange(0, n, dtype=np.float64)
+
+  # parabola through the top three pixels
+  a = corrected[rows, np.maximum(pixels - 1, 0)]
+  b = corrected[rows, pixels]
+  c = corrected[rows, np.minimum(pixels + 1, n - 1)]
+  curvature = a - 2*b + c
+  inside = (pixels > 0) & (pixels < n - 1) & (curvature < 0)
+  delta = np.zeros(len(pixels))
+  np.divide(0.5 * (a - c), curvature, out=delta, where=inside)
+  delta = np.clip(delta, -0.5, 0.5)
+  height = b - 0.25 * (a - c) * delta
+  centre = pixels + delta
+
+  # window of 2*maxWidth+1 pixels around each peak, one row per peak
+  offsets = np.arange(-maxWidth, maxWidth + 1)
+  columns = pixels[:, None] + offsets
+  valid = (columns >= 0) & (columns < n)
+  columns = np.clip(columns, 0, n - 1)
+  window = corrected[rows[:, None], columns]
+  middle = maxWidth
+
+  # last pixel below half height left of the peak and first one right of it,
+  # the crossing is interpolated towards the neighbour above half height
+  half = height[:, None] / 2
+  below = (window < half) | ~valid
+  left = np.where(below & (offsets < 0), np.arange(0, len(offsets)), -1).max(axis=1)
+  right = np.where(below & (offsets > 0), np.arange(0, len(offsets)), len(offsets)).min(axis=1)
+  resolved = (left >= 0) & (right < len(offsets)) & valid[np.arange(len(pixels)), np.clip(left, 0, None)] & valid[np.arange(len(pixels)), np.clip(right, None, len(offsets) - 1)]
+  left = np.clip(left, 0, len(offsets) - 2)
+  right = np.clip(right, 1, len(offsets) - 1)
+
+  def crossing(inner, outer):
+    yIn = np.take_along_axis(window, inner[:, None], axis=1)[:, 0]
+    yOut = np.take_along_axis(window, outer[:, None], axis=1)[:, 0]
+    step = yIn - yOut
+    fraction = np.divide(yIn - half[:, 0], step, out=np.zeros(len(step)), where=step != 0)
+    return pixels + (inner - middle) + (outer - inner) * fraction
+
+  leftEdge = crossing(left + 1, left)
+  rightEdge = crossing(right - 1, right)
+  fwhm = np.interp(rightEdge, pixelAxis, xs) - np.interp(leftEdge, pixelAxis, xs)
+  fwhm[~resolved] = np.nan
+
+  # area down to where the peak meets the baseline
+  atBaseline = (window <= 0) | ~valid
+  start = np.where(atBaseline & (offsets < 0), np.arange(0, len(offsets)), -1).max(axis=1) + 1
+  end = np.where(atBaseline & (offsets > 0), np.arange(0, len(offsets)), len(offsets)).min(axis=1)
+  inPeak = (np.arange(0, len(offsets)) >= start[:, None]) & (np.arange(0, len(offsets)) < end[:, None])
+  area = np.sum(np.where(inPeak, window * wlWidths[columns], 0.), axis=1)
+
+  return {
+    'row': rows,
+    'pixel': pixels,
+    'position': np.interp(centre, pixelAxis, xs),
+    'height': height,
+    'fwhm': fwhm,
+    'area': area
+  }
+
+# All peaks of a spectrum {'xs', 'ys'} (ys 1-D or 2-D) as a dict of arrays, one
+# value per peak, 'row' is the spectrum of each peak. minHeight is above the
+# baseline; baselineWidth should be wider than the peaks.
+def extractFeatures(spectrum, minHeight=None, distance=3, baselineWidth=50, maxWidth=50):
+  xs = np.asarray(spectrum['xs'], dtype=np.float64)
+  ys = np.atleast_2d(np.asarray(spectrum['ys'], dtype=np.float64))
+  corrected = ys - estimateBaseline(ys, baselineWidth)
+  rows, pixels = findPeaks(corrected, minHeight, distance)
+  return peakProperties(xs, corrected, rows, pixels, maxWidth)
+
+# The highest peak within each region {'min', 'max'} (nm) of every row of ys,
+# as a dict of (rows x regions) arrays.
+def trackPeaks(xs, ys, regions, baselineWidth=50, maxWidth=50, wlWidths=None):
+  xs = np.asarray(xs, dtype=np.float64)
+  ys = np.atleast_2d(np.asarray(ys, dtype=np.float64))
+  corrected = ys - estimateBaseline(ys, baselineWidth)
+  count = len(ys)
+
+  rows = []
+  pixels = []
+  for region in regions:
+    start, end = np.searchsorted(xs, [region['min'], region['max']], side='left')
+    start = min(start, len(xs) - 1)
+    end = max(end, start + 1)
+    rows.append(np.arange(0, count))
+    pixels.append(start + np.argmax(corrected[:, start:end], axis=1))
+
+  features = peakProperties(xs, corrected, np.concatenate(rows), np.concatenate(pixels), maxWidth, wlWidths)
+  return {name: values.reshape(len(regions), count).T for name, values in features.items() if name != 'row'}
+
+# features of the regions for every record of a SpectrumArchive, read chunk by
+# chunk; returns trackPeaks() arrays and the 'timestamp' of the records
+def archiveFeatures(archive, regions, chunkSize=1000, baselineWidth=50, maxWidth=50):
+  xs = np.asarray(archive.wavelengths, dtype=np.float64)
+  wlWidths = calcWlWidths(xs)
+  chunks = []
+  for start in range(0, len(archive), chunkSize):
+    ys = archive.intensities(slice(start, start + chunkSize))
+    chunks.append(trackPeaks(xs, ys, regions, baselineWidth, maxWidth, wlWidths))
+
+  if len(chunks) == 0:
+    return {}
+  features = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+  features['timestamp'] = np.array(archive.index()['timestamp'])
+  return features
+
+# Feature time series of a live stream: for every spectrum passed to update()
+# only the peak features of the regions are kept, in arrays that grow by
+# doubling, so raw spectra do not have to be stored.
+class FeatureTracker:
+  FIELDS = ['position', 'height', 'fwhm', 'area']
+
+  def __init__(self, xs, regions, baselineWidth=50, maxWidth=50, capacity=1024):
+    self.xs = np.asarray(xs, dtype=np.float64)
+    self.regions = regions
+    self.baselineWidth = baselineWidth
+    self.maxWidth = maxWidth
+    self._wlWidths = calcWlWidths(self.xs)
+    self._timestamps = np.zeros(capacity)
+    self._features = {name: np.zeros((capacity, len(regions))) for name in self.FIELDS}
+    self.count = 0
+
+  # features of one spectrum (or the rows of a 2-D array), returned as well
+  def update(self, spectrum, timestamp=None):
+    ys = np.atleast_2d(spectrum['ys'])
+    features = trackPeaks(self.xs, ys, self.regions, self.baselineWidth, self.maxWidth, self._wlWidths)
+    if timestamp is None:
+      timestamp = spectrum.get('timestamp', np.nan)
+
+    end = self.count + len(ys)
+    if end > len(self._timestamps):
+      self._grow(end)
+    self._timestamps[self.count:end] = timestamp
+    for name in self.FIELDS:
+      self._features[name][self.count:end] = features[name]
+    self.count = end
+    return features
+
+  def _grow(self, required):
+    capacity = max(required, 2 * len(self._timestamps))
+    timestamps = np.zeros(capacity)
+    timestamps[:self.count] = self._timestamps[:self.count]
+    self._timestamps = timestamps
+    for name in self.FIELDS:
+      features = np.zeros((capacity, len(self.regions)))
+      features[:self.count] = self._features[name][:self.count]
+      self._features[name] = features
+
+  # 'timestamp' and (spectra x regions) arrays of the features so far, as
+  # read-only views
+  def series(self):
+    series = {'timestamp': self._timestamps[:self.count]}
+    for name in self.FIELDS:
+      series[name] = self._features[name][:self.count]
+    for values in series.values():
+      values.flags.writeable = False
+    return series
+
+  def reset(self):
+    self.count = 0
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+import numpy as np
+from read_files import readCalibrationFile
+
+### IRRADIANCE ###
+
+# width of the wavelength bin of each pixel, in nm
+def calcWlWidths(xs):
+  return np.gradient(np.asarray(xs, dtype=np.float64))
+
+# spectral irradiance in uW/cm^2/nm from the light and dark spectrum (counts),
+# the calibration (uJ/count), integration time (us) and collection area (cm^2)
+def calcIrradiance(lightSpectrum, darkSpectrum, calibration, integrationTime, collectionArea, wlWidths):
+  xs = np.asarray(lightSpectrum['xs'], dtype=np.float64)
+  calibrationYs = np.interp(xs, calibration['xs'], calibration['ys'])
+  counts = np.subtract(lightSpectrum['ys'], darkSpectrum['ys'])
+
+  ys = counts * calibrationYs / (integrationTime / 1000000 * collectionArea * wlWidths)
+  return {'xs': xs, 'ys': ys}
+
+# irradiance in uW/cm^2 for every region {'min', 'max'} (in nm), stored under
+# 'irradiance' of the region; with the pixel mask of the spectrum also the
+# mask bits within the region under 'flags'
+def calcIrradianceForRegions(irrad, regions, wlWidths, mask=None):
+  engine = IrradianceEngine(irrad['xs'], wlWidths=wlWidths)
+  values = engine.integrateRegions(irrad['ys'], regions)
+
+  for region, value in zip(regions, values):
+    region['irradiance'] = float(value)
+
+  if mask is not None:
+    for region, flags in zip(regions, engine.regionFlags(mask, regions)):
+      region['flags'] = int(flags)
+
+  return regions
+
+# Irradiance for one wavelength axis (one device) and calibration. The
+# interpolated calibration, bin widths and their combined factor are
+# calculated once. Spectra can be 1-D or 2-D (one spectrum per row), regions
+# are integrated from a cumulative sum table, so each region costs O(1).
+class IrradianceEngine:
+  def __init__(self, xs, calibration=None, collectionArea=1.0, wlWidths=None):
+    self.xs = np.array(xs, dtype=np.float64)
+    self.xs.flags.writeable = False
+    self.wlWidths = calcWlWidths(self.xs) if wlWidths is None else np.array(wlWidths, dtype=np.float64)
+    self.wlWidths.flags.writeable = False
+    self.collectionArea = collectionArea
+
+    # without calibration only integration of counts is possible
+    self.calibration = None
+    self._factor = None
+    if calibration is not None:
+      self.calibration = np.interp(self.xs, calibration['xs'], calibration['ys'])
+      self._factor = self.calibration / (collectionArea * self.wlWidths)
+
+  # spectral irradiance in uW/cm^2/nm from counts; integrationTime in us is a
+  # scalar or one value per spectrum
+  def irradiance(self, lightYs, darkYs, integrationTime):
+    if self._factor is None:
+      raise ValueError('irradiance needs a calibration')
+
+    counts = np.subtract(lightYs, darkYs)
+    seconds = np.asarray(integrationTime, dtype=np.float64) / 1000000
+    if seconds.ndim > 0:
+      seconds = seconds[:, np.newaxis]
+    return counts * self._factor / seconds
+
+  # cumulative sum of ys*width with a leading 0, along the last axis
+  def cumulative(self, ys):
+    ys = np.asarray(ys, dtype=np.float64)
+    table = np.zeros(ys.shape[:-1] + (ys.shape[-1] + 1,))
+    np.cumsum(ys * self.wlWidths, axis=-1, out=table[..., 1:])
+    return table
+
+  # pixel index ranges of the regions [{'min', 'max'}, ...], limits included
+  def regionBounds(self, regions):
+    mins = np.array([region['min'] for region in regions], dtype=np.float64)
+    maxs = np.array([region['max'] for region in regions], dtype=np.float64)
+    return np.searchsorted(self.xs, mins, side='left'), np.searchsorted(self.xs, maxs, side='right')
+
+  # integral of ys over every region, shape (..., number of regions);
+  # ys is irradiance (gives uW/cm^2) or counts
+  def integrateRegions(self, ys, regions, table=None):
+    if table is None:
+      table = self.cumulative(ys)
+    starts, ends = self.regionBounds(regions)
+    return table[..., ends] - table[..., starts]
+
+  # OR of the uint8 pixel mask (see masks.py) over every region
+  def regionFlags(self, mask, regions):
+    mask = np.asarray(mask, dtype=np.uint8)
+    starts, ends = self.regionBounds(regions)
+    flags = np.zeros(mask.shape[:-1] + (len(starts),), dtype=np.uint8)
+    for bit in range(0, 8):
+      table = np.zeros(mask.shape[:-1] + (mask.shape[-1] + 1,), dtype=np.int64)
+      np.cumsum((mask >> bit) & 1, axis=-1, out=table[..., 1:])
+      flags |= np.where(table[..., ends] - table[..., starts] > 0, 1 << bit, 0).astype(np.uint8)
+    return flags
+
+_calibrationCache = {}
+_engineCache = {}
+
+def loadCalibration(filename):
+  if filename not in _calibrationCache:
+    _calibrationCache[filename] = readCalibrationFile(filename)
+  return _calibrationCache[filename]
+
+# one engine per calibration file, collection area and wavelength axis
+def getIrradianceEngine(calibrationFile, xs, collectionArea):
+  xs = np.asarray(xs, dtype=np.float64)
+  key = (calibrationFile, collectionArea, xs.tobytes())
+  if key not in _engineCache:
+    _engineCache[key] = IrradianceEngine(xs, loadCalibration(calibrationFile), collectionArea)
+  return _engineCache[key]
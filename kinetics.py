@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+import os
+import json
+import math
+import time
+import queue
+import logging
+import threading
+import numpy as np
+from archive import SpectrumArchive
+
+log = logging.getLogger(__name__)
+
+### TIME SERIES ACQUISITION ###
+
+# running mean, standard deviation and maximum of a value (Welford)
+class _RunningStats:
+  def __init__(self):
+    self.count = 0
+    self.mean = 0.0
+    self.max = 0.0
+    self._m2 = 0.0
+
+  def add(self, value):
+    self.count += 1
+    delta = value - self.mean
+    self.mean += delta / self.count
+    self._m2 += delta * (value - self.mean)
+    self.max = max(self.max, value)
+
+  def std(self):
+    return math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+# Spectra every `interval` seconds, scheduled on a monotonic clock: frame k is
+# started at t0 + k*interval, so timing errors do not accumulate. Frames are
+# written to a SpectrumArchive by a background thread, acquisition never waits
+# for the disk. A frame that cannot be started within its interval is dropped
+# and counted. The run settings and start time are kept next to the archive
+# (<archive>.run.json), so an interrupted run is resumed on the same schedule.
+class KineticsRun:
+  def __init__(self, spectrometer, archivePath, interval, integrationTime, scansToAverage=1, boxcarWidth=0, correctDarkCounts=False, correctNonlinearity=False, duration=None, writeQueueLength=1000):
+    # one frame takes about scans x integration time
+    acquisitionTime = scansToAverage * integrationTime / 1000000
+    if interval < acquisitionTime:
+      raise ValueError('interval {0} s is shorter than the acquisition time {1} s'.format(interval, acquisitionTime))
+
+    self.spectrometer = spectrometer
+    self.archivePath = archivePath
+    self.statePath = archivePath + '.run.json'
+    self.duration = duration
+    self.settings = {
+      'interval': interval,
+      'integrationTime': integrationTime,
+      'scansToAverage': scansToAverage,
+      'boxcarWidth': boxcarWidth,
+      'correctDarkCounts': correctDarkCounts,
+      'correctNonlinearity': correctNonlinearity
+    }
+
+    self.frames = 0
+    self.dropped = 0
+    self.writeDropped = 0
+    self.jitter = _RunningStats()
+    self._writeQueue = queue.Queue(maxsize=writeQueueLength)
+    self._writerError = None
+
+  # start time of the run, from the state file when resuming; an archive
+  # without a state file is not replaced unless resume is False
+  def _loadOrCreateState(self, resume):
+    if resume and os.path.exists(self.statePath):
+      with open(self.statePath) as f:
+        state = json.load(f)
+      if state['settings'] != self.settings:
+        raise ValueError('settings differ from the interrupted run in {0}'.format(self.statePath))
+      log.info('resuming run started at %s', time.ctime(state['startTime']))
+      return state['startTime']
+
+    if os.path.exists(self.archivePath):
+      if resume:
+        raise ValueError('{0} exists and is not an interrupted run, restart to overwrite it'.format(self.archivePath))
+      os.remove(self.archivePath)
+    startTime = time.time()
+    with open(self.statePath, 'w') as f:
+      json.dump({'startTime': startTime, 'settings': self.settings}, f)
+    return startTime
+
+  def run(self, stopEvent=None, callback=None, resume=True):
+    stopEvent = stopEvent or threading.Event()
+    interval = self.settings['interval']
+
+    self.spectrometer.setIntegrationTime(self.settings['integrationTime'])
+    # the first spectrum after the change may still use the old setting
+    stopEvent.wait(self.settings['integrationTime'] / 1000000)
+
+    startTime = self._loadOrCreateState(resume)
+    archive = SpectrumArchive.open(self.archivePath, self.spectrometer.wavelengths)
+    if len(archive.wavelengths) != len(self.spectrometer.wavelengths) or not np.allclose(archive.wavelengths, self.spectrometer.wavelengths):
+      archive.close()
+      raise ValueError('wavelengths of the spectrometer do not match the archive {0}'.format(self.archivePath))
+
+    # monotonic clock anchored to the (possibly earlier) wall clock start; the
+    # slot in progress is the first one, 0 for a new run
+    t0 = time.monotonic() - (time.time() - startTime)
+    k = max(len(archive), math.floor((time.monotonic() - t0) / interval))
+    # frames missed while the run was interrupted, not the ones in the archive
+    self.dropped += k - len(archive)
+    writer = threading.Thread(target=self._writeFrames, args=(archive,), daemon=True)
+    writer.start()
+
+    try:
+      while not stopEvent.is_set():
+        scheduled = t0 + k * interval
+        if self.duration is not None and scheduled - t0 > self.duration:
+          break
+        if stopEvent.wait(max(scheduled - time.monotonic(), 0.0)):
+          break
+
+        start = time.monotonic()
+        startWall = time.time()
+        self.jitter.add(start - scheduled)
+        spectrum = self.spectrometer.readSpectrumFromDevice(
+          self.settings['scansToAverage'],
+          self.settings['boxcarWidth'],
+          self.settings['correctDarkCounts'],
+          self.settings['correctNonlinearity']
+        )
+        # timestamp in the middle of the exposure
+        timestamp = startWall + (time.monotonic() - start) / 2
+        self.frames += 1
+
+        try:
+          self._writeQueue.put_nowait((spectrum['ys'], timestamp))
+        except queue.Full:
+          self.writeDropped += 1
+
+        # skip the slots that have already passed
+        nextK = max(k + 1, math.ceil((time.monotonic() - t0) / interval))
+        self.dropped += nextK - k - 1
+        k = nextK
+
+        if callback:
+          callback(self.statistics())
+    finally:
+      self._writeQueue.put(None)
+      writer.join()
+      archive.close()
+
+    if self._writerError is not None:
+      raise self._writerError
+    return self.statistics()
+
+  def _writeFrames(self, archive):
+    settings = self.settings
+    while True:
+      item = self._writeQueue.get()
+      if item is None:
+        break
+      if self._writerError is not None:
+        continue
+
+      ys, timestamp = item
+      try:
+        archive.append(
+          {'ys': ys},
+          timestamp,
+          settings['integrationTime'],
+          settings['scansToAverage'],
+          settings['boxcarWidth'],
+          settings['correctDarkCounts'],
+          settings['correctNonlinearity']
+        )
+        # complete frames are on disk if the process dies
+        archive.flush()
+      except Exception as e:
+        self._writerError = e
+
+  # jitter is the delay of the frame start after its scheduled time, in s
+  def statistics(self):
+    return {
+      'frames': self.frames,
+      'dropped': self.dropped,
+      'writeDropped': self.writeDropped,
+      'jitterMean': self.jitter.mean,
+      'jitterStd': self.jitter.std(),
+      'jitterMax': self.jitter.max
+    }
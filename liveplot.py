@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+import numpy as np
+
+### FAST PLOT UPDATES ###
+
+# Keeps one persistent Line2D per trace and redraws only the lines on top of a
+# cached background (blitting). The full figure (axes, ticks, legend) is drawn
+# only when the set of traces changes or the data leaves the axis limits; the
+# limits are set with a margin, so small changes do not rescale.
+# https://matplotlib.org/stable/tutorials/advanced/blitting.html
+class LivePlot:
+  def __init__(self, axes, margin=0.05, maxPoints=None):
+    self.axes = axes
+    self.canvas = axes.figure.canvas
+    self.margin = margin
+    # traces longer than this are decimated (min/max per bin)
+    self.maxPoints = maxPoints
+    self.lines = {}
+    self._background = None
+    self._limits = None
+    self.canvas.mpl_connect('draw_event', self._onDraw)
+
+  # sets or updates the trace name, style is passed to plot() for new traces
+  def update(self, name, xs, ys, **style):
+    xs, ys = self.decimate(xs, ys)
+    line = self.lines.get(name)
+    fullDraw = False
+
+    if line is None:
+      style.setdefault('linewidth', 0.5)
+      line, = self.axes.plot(xs, ys, animated=True, label=name, **style)
+      self.lines[name] = line
+      fullDraw = True
+    elif len(line.get_xdata()) == len(xs) and np.array_equal(line.get_xdata(), xs):
+      line.set_ydata(ys)
+    else:
+      line.set_data(xs, ys)
+
+    if self._rescale() or fullDraw:
+      self.canvas.draw()
+    else:
+      self.blit()
+
+  def remove(self, name):
+    line = self.lines.pop(name, None)
+    if line is not None:
+      line.remove()
+      self._rescale()
+      self.canvas.draw()
+
+  def clear(self):
+    for line in self.lines.values():
+      line.remove()
+    self.lines = {}
+    self._limits = None
+    self.canvas.draw()
+
+  def blit(self):
+    if self._background is None:
+      self.canvas.draw()
+      return
+
+    self.canvas.restore_region(self._background)
+    self._drawLines()
+    self.canvas.blit(self.axes.figure.bbox)
+    self.canvas.flush_events()
+
+  # min/max of each bin keeps the peaks when there are more points than pixels
+  def decimate(self, xs, ys):
+    xs = np.asarray(xs)
+    ys = np.asarray(ys)
+    if self.maxPoints is None or len(ys) <= self.maxPoints:
+      return xs, ys
+
+    bins = self.maxPoints // 2
+    size = len(ys) // bins
+    n = bins * size
+    binnedYs = ys[:n].reshape(bins, size)
+    binnedXs = xs[:n].reshape(bins, size)
+    return np.repeat(binnedXs[:, size // 2], 2), np.column_stack((binnedYs.min(axis=1), binnedYs.max(axis=1))).ravel()
+
+  # new limits when the data leaves the current ones or fills less than
+  # half of them; returns True if the limits changed
+  def _rescale(self):
+    if len(self.lines) == 0:
+      return False
+
+    xMin = min(np.nanmin(line.get_xdata()) for line in self.lines.values())
+    xMax = max(np.nanmax(line.get_xdata()) for line in self.lines.values())
+    yMin = min(np.nanmin(line.get_ydata()) for line in self.lines.values())
+    yMax = max(np.nanmax(line.get_ydata()) for line in self.lines.values())
+
+    if self._limits is not None:
+      lxMin, lxMax, lyMin, lyMax = self._limits
+      inside = lxMin <= xMin and xMax <= lxMax and lyMin <= yMin and yMax <= lyMax
+      if inside and (yMax - yMin) >= 0.5 * (lyMax - lyMin):
+        return False
+
+    yMargin = max((yMax - yMin) * self.margin, 1.0)
+    self._limits = (xMin, xMax, yMin - yMargin, yMax + yMargin)
+    self.axes.set_xlim(xMin, xMax)
+    self.axes.set_ylim(yMin - yMargin, yMax + yMargin)
+    return True
+
+  def _onDraw(self, event):
+    self._background = self.canvas.copy_from_bbox(self.axes.figure.bbox)
+    self._drawLines()
+
+  def _drawLines(self):
+    for line in self.lines.values():
+      self.axes.draw_artist(line)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+import numpy as np
+
+### PIXEL QUALITY MASKS ###
+
+# bits of the uint8 mask returned next to 'ys'
+MASK_SATURATED = 1
+# above the linear range of the detector
+MASK_NONLINEAR = 2
+# much higher than its neighbours in every scan of a dark spectrum
+MASK_HOT_PIXEL = 4
+# not measured, copied from pixel 2 (as OceanView does)
+MASK_FIXED = 8
+
+MASK_NAMES = {
+  MASK_SATURATED: 'saturated',
+  MASK_NONLINEAR: 'nonlinear',
+  MASK_HOT_PIXEL: 'hot pixel',
+  MASK_FIXED: 'fixed'
+}
+
+# pixels higher than the mean of their neighbours by this many times the noise
+HOT_PIXEL_SIGMAS = 10.
+
+# Pixel mask of averaged scans, updated with every scan as it arrives.
+# Saturation and nonlinearity are kept if they occur in any scan. Hot pixels
+# are only looked for in dark scans (isDark), where nothing else makes a
+# single pixel stand out; the top of a narrow emission line would in a light
+# scan. A pixel is hot if it stands out in all the scans (a cosmic ray hits a
+# single scan). hotPixels, a boolean array found in a dark, is flagged as well.
+class PixelMask:
+  def __init__(self, pixels, saturationLevel, nonlinearLevel, isDark=False, hotPixels=None):
+    self.pixels = pixels
+    self.saturationLevel = saturationLevel
+    self.nonlinearLevel = nonlinearLevel
+    self.isDark = isDark
+    self.hotPixels = None if hotPixels is None else np.asarray(hotPixels, dtype=bool)
+    self.reset()
+
+  def reset(self):
+    self._flags = np.zeros(self.pixels, dtype=np.uint8)
+    self._hot = np.ones(self.pixels, dtype=bool)
+    self.count = 0
+    self.saturatedScans = 0
+
+  # flags of one scan; returns True if it has saturated pixels
+  def add(self, ys):
+    ys = np.asarray(ys)
+    saturated = ys >= self.saturationLevel
+    self._flags |= np.where(saturated, MASK_SATURATED, 0).astype(np.uint8)
+    self._flags |= np.where(ys >= self.nonlinearLevel, MASK_NONLINEAR, 0).astype(np.uint8)
+    if self.isDark:
+      self._hot &= hotPixels(ys)
+    self.count += 1
+
+    isSaturated = bool(saturated[2:].any())
+    if isSaturated:
+      self.saturatedScans += 1
+    return isSaturated
+
+  # combined uint8 mask of the scans so far
+  def mask(self):
+    mask = self._flags.copy()
+    if self.isDark and self.count > 0:
+      mask |= np.where(self._hot, MASK_HOT_PIXEL, 0).astype(np.uint8)
+    if self.hotPixels is not None:
+      mask |= np.where(self.hotPixels, MASK_HOT_PIXEL, 0).astype(np.uint8)
+    mask[0:2] = MASK_FIXED
+    return mask
+
+# pixels standing out above both neighbours by HOT_PIXEL_SIGMAS times the
+# noise (median absolute difference of neighbouring pixels)
+def hotPixels(ys, sigmas=HOT_PIXEL_SIGMAS):
+  ys = np.asarray(ys, dtype=np.float64)
+  hot = np.zeros(ys.shape, dtype=bool)
+  if ys.shape[-1] < 3:
+    return hot
+
+  differences = np.abs(np.diff(ys, axis=-1))
+  noise = 1.4826 * np.median(differences, axis=-1, keepdims=True) / np.sqrt(2)
+  neighbours = np.maximum(ys[..., :-2], ys[..., 2:])
+  hot[..., 1:-1] = ys[..., 1:-1] - neighbours > sigmas * np.maximum(noise, 1.)
+  return hot
+
+# a flagged pixel taints the pixels a boxcar of the width averages it into
+def dilateMask(mask, width):
+  mask = np.asarray(mask, dtype=np.uint8)
+  if width <= 0:
+    return mask.copy()
+
+  n = mask.shape[-1]
+  i = np.arange(0, n)
+  starts = np.clip(i - width, 0, n)
+  ends = np.clip(i + width + 1, 0, n)
+  out = np.zeros(mask.shape, dtype=np.uint8)
+  for bit in MASK_NAMES:
+    cumulative = np.zeros(mask.shape[:-1] + (n + 1,), dtype=np.int64)
+    np.cumsum((mask & bit) != 0, axis=-1, out=cumulative[..., 1:])
+    out |= np.where(cumulative[..., ends] - cumulative[..., starts] > 0, bit, 0).astype(np.uint8)
+  return out
+
+# contiguous runs of pixels with any of the bits set, as regions
+# {'min', 'max', 'flags'} in nm, flags is the OR of the run
+def flaggedRegions(xs, mask, bits=MASK_SATURATED | MASK_NONLINEAR | MASK_HOT_PIXEL):
+  mask = np.asarray(mask, dtype=np.uint8)
+  flagged = (mask & bits) != 0
+  edges = np.diff(np.concatenate([[0], flagged.astype(np.int8), [0]]))
+  starts = np.nonzero(edges == 1)[0]
+  ends = np.nonzero(edges == -1)[0]
+  return [
+    {'min': float(xs[start]), 'max': float(xs[end - 1]), 'flags': int(np.bitwise_or.reduce(mask[start:end] & bits))}
+    for start, end in zip(starts, ends)
+  ]
+
+# 'saturated, nonlinear' for the bits set in flags
+def describeFlags(flags):
+  return ', '.join([name for bit, name in MASK_NAMES.items() if flags & bit])
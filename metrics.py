@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+import csv
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+### TIMING METRICS ###
+
+# histogram bin edges in seconds, 10 per decade from 1 us to 100 s
+BIN_EDGES = [10**(e / 10) for e in range(-60, 21)]
+
+# Latency of processing stages (usbRead, accumulate per scan, average per
+# read, pixelFixup, boxcar, plotUpdate, fileWrite, ...). Every stage keeps its count, total, min, max
+# and a histogram with logarithmic bins, so memory does not grow with the
+# number of measurements. Thread safe; disable it to remove the overhead.
+class Metrics:
+  def __init__(self, enabled=True):
+    self.enabled = enabled
+    self._stages = {}
+    self._lock = threading.Lock()
+
+  def record(self, stage, seconds):
+    if not self.enabled:
+      return
+
+    with self._lock:
+      data = self._stages.get(stage)
+      if data is None:
+        data = {'count': 0, 'total': 0.0, 'min': seconds, 'max': seconds, 'histogram': [0] * (len(BIN_EDGES) + 1)}
+        self._stages[stage] = data
+      data['count'] += 1
+      data['total'] += seconds
+      data['min'] = min(data['min'], seconds)
+      data['max'] = max(data['max'], seconds)
+      data['histogram'][bisect.bisect_right(BIN_EDGES, seconds)] += 1
+
+  @contextmanager
+  def timer(self, stage):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.record(stage, time.perf_counter() - start)
+
+  def reset(self):
+    with self._lock:
+      self._stages = {}
+
+  # upper edge of the histogram bin holding the given fraction of the values
+  def _percentile(self, data, fraction):
+    target = fraction * data['count']
+    count = 0
+    for i, binCount in enumerate(data['histogram']):
+      count += binCount
+      if count >= target:
+        return min(BIN_EDGES[i] if i < len(BIN_EDGES) else data['max'], data['max'])
+    return data['max']
+
+  # stage -> count, mean, min, max, p50, p95 (seconds)
+  def summary(self):
+    with self._lock:
+      return {
+        stage: {
+          'count': data['count'],
+          'mean': data['total'] / data['count'],
+          'min': data['min'],
+          'max': data['max'],
+          'p50': self._percentile(data, 0.5),
+          'p95': self._percentile(data, 0.95)
+        }
+        for stage, data in self._stages.items()
+      }
+
+  def histograms(self):
+    with self._lock:
+      return {stage: list(data['histogram']) for stage, data in self._stages.items()}
+
+  def exportJson(self, filePath):
+    with open(filePath, 'w') as f:
+      json.dump({'binEdges': BIN_EDGES, 'summary': self.summary(), 'histograms': self.histograms()}, f, indent=2)
+
+  def exportCsv(self, filePath):
+    with open(filePath, 'w', newline='') as f:
+      writer = csv.writer(f)
+      writer.writerow(['stage', 'count', 'mean [s]', 'min [s]', 'max [s]', 'p50 [s]', 'p95 [s]'])
+      for stage, data in self.summary().items():
+        writer.writerow([stage, data['count'], data['mean'], data['min'], data['max'], data['p50'], data['p95']])
+
+  # one line per stage, mean and p95 in ms
+  def overlayText(self):
+    return '\n'.join(['{0}: {1:.2f} ms (p95 {2:.2f})'.format(stage, data['mean']*1000, data['p95']*1000) for stage, data in self.summary().items()])
+
+# shared by all modules
+metrics = Metrics()
@@ -6,65 +6,138 @@
 ## Description: Part of WLIC - simple GUI program for collecting spectra from
 ##              spectrometer.
 
-import pandas
+import os
+import time
+import numpy as np
+from metrics import metrics
 
-def readSpectrumFromFile(filename):
-  file = open(filename, mode='r')
-  lines = file.readlines()
-  file.close()
+# The readers load the whole file and parse the numeric block with a single
+# vectorized call, instead of splitting and converting line by line. Comma
+# decimal separators (OceanView with some locales) are converted on the whole
+# block at once. A token that is not a number, or a line with a missing or
+# extra value, raises ValueError like the line by line parsing did.
+
+def _readText(filename):
+  with open(filename, mode='r') as file:
+    return file.read()
+
+def _parseNumbers(text, columns=1):
+  values = np.array(text.replace(',', '.').split(), dtype=np.float64)
+  if columns == 1:
+    return values
+  lines = len([line for line in text.splitlines() if line.strip()])
+  if len(values) != lines * columns:
+    raise ValueError('expected {0} values on each of {1} lines, got {2}'.format(columns, lines, len(values)))
+  return values.reshape(-1, columns)
+
+# offset of the line count lines after the one at start
+def _skipLines(text, count, start=0):
+  offset = start
+  for i in range(0, count):
+    offset = text.find('\n', offset) + 1
+    if offset == 0:
+      return len(text)
+  return offset
+
+# acquisition settings of an OceanView header, as written by
+# writeOceanViewFile; only the ones found are returned
+def _parseHeader(header):
+  settings = {}
+  for line in header.splitlines():
+    name, separator, value = line.partition(':')
+    if separator == '':
+      continue
+    value = value.strip()
+    try:
+      if name == 'Integration Time (sec)':
+        settings['integrationTime'] = int(round(float(value.replace(',', '.')) * 1000000))
+      elif name == 'Scans to average':
+        settings['scans'] = int(value)
+      elif name == 'Boxcar width':
+        settings['boxcarWidth'] = int(value)
+      elif name == 'Electric dark correction enabled':
+        settings['correctDarkCounts'] = value.lower() == 'true'
+      elif name == 'Nonlinearity correction enabled':
+        settings['correctNonlinearity'] = value.lower() == 'true'
+    except ValueError:
+      continue
+  return settings
 
-  xs = []
-  ys = []
+# 'xs' and 'ys', and the settings found in the header ('integrationTime' in
+# us, 'scans', 'boxcarWidth', 'correctDarkCounts', 'correctNonlinearity')
+def readSpectrumFromFile(filename):
+  text = _readText(filename)
   
-  insideData = False
+  begin = text.find('>>>>>Begin')
+  if begin == -1:
+    return {'xs': np.empty(0), 'ys': np.empty(0)}
+  settings = _parseHeader(text[:begin])
   
-  for i in range (0, len(lines)):
-    if lines[i].startswith('>>>>>End'):
-      insideData = False
-      break
-    
-    if lines[i].startswith('>>>>>Begin'):
-      insideData = True
-      continue
-    
-    if insideData:
-      line = lines[i].rstrip('\r\n').replace(',', '.').split("\t")
-      xs.append(float(line[0]))
-      ys.append(float(line[1]))
-    
-  return {'xs': xs, 'ys': ys}
+  # data starts on the line after the begin marker
+  begin = _skipLines(text, 1, begin)
+  end = text.find('>>>>>End', begin)
+  if end == -1:
+    end = len(text)
+  
+  data = _parseNumbers(text[begin:end], 2)
+  spectrum = {'xs': data[:, 0], 'ys': data[:, 1]}
+  spectrum.update(settings)
+  return spectrum
 
 def readCalibrationFile(filename):
-  file = open(filename, mode='r')
-  lines = file.readlines()
-  file.close()
+  text = _readText(filename)
   
-  xs = []
-  ys = []
+  # 9 lines of header
+  data = _parseNumbers(text[_skipLines(text, 9):], 2)
+  return {'xs': data[:, 0], 'ys': data[:, 1]}
 
-  for i in range (9, len(lines)):
-    line = lines[i].rstrip('\r\n').split("\t")
-    xs.append(float(line[0]))
-    ys.append(float(line[1]))
-    
-  return {'xs': xs, 'ys': ys}
+# two column file without a header, as written by writeSpectrumToFile
+def readSpectrumFromTsvFile(filename):
+  data = _parseNumbers(_readText(filename), 2)
+  return {'xs': data[:, 0], 'ys': data[:, 1]}
 
 def readFileSimple(filename):
-  file = open(filename, mode='r')
-  lines = file.readlines()
-  file.close()
-  
-  xs = []
-
-  for i in range (0, len(lines)):
-    line = lines[i].rstrip('\r\n')
-    xs.append(float(line))
-       
-  return xs
+  return _parseNumbers(_readText(filename))
 
+# two tab separated columns, numbers written with their shortest exact repr
 def writeSpectrumToFile(spectrum, filePath):
-  df = pandas.DataFrame(spectrum)
-  with open(filePath, 'w', newline='') as f:
-    df.to_csv(f, sep='\t', columns=['xs', 'ys'], index=False, header=False)
+  with metrics.timer('fileWrite'):
+    xs = np.asarray(spectrum['xs']).tolist()
+    ys = np.asarray(spectrum['ys']).tolist()
+    with open(filePath, 'w', newline='') as f:
+      f.write(''.join(['{0!r}\t{1!r}{2}'.format(x, y, os.linesep) for x, y in zip(xs, ys)]))
     
-  return
\ No newline at end of file
+  return
+
+# OceanView like export, readable by readSpectrumFromFile; metadata holds the
+# acquisition settings (integrationTime in us, scans, boxcarWidth, correction
+# flags, serial and timestamp), missing keys are left out of the header
+def writeOceanViewFile(spectrum, filePath, metadata=None):
+  metadata = metadata or {}
+  xs = np.asarray(spectrum['xs']).tolist()
+  ys = np.asarray(spectrum['ys']).tolist()
+  
+  header = ['Data from {0} Node'.format(os.path.basename(filePath)), '']
+  header.append('Date: {0}'.format(time.strftime('%a %b %d %H:%M:%S %Z %Y', time.localtime(metadata.get('timestamp', time.time())))))
+  if 'serial' in metadata:
+    header.append('Spectrometer: {0}'.format(metadata['serial']))
+  if 'integrationTime' in metadata:
+    header.append('Integration Time (sec): {0:E}'.format(metadata['integrationTime'] / 1000000))
+  if 'scans' in metadata:
+    header.append('Scans to average: {0}'.format(metadata['scans']))
+  if 'correctDarkCounts' in metadata:
+    header.append('Electric dark correction enabled: {0}'.format(str(bool(metadata['correctDarkCounts'])).lower()))
+  if 'correctNonlinearity' in metadata:
+    header.append('Nonlinearity correction enabled: {0}'.format(str(bool(metadata['correctNonlinearity'])).lower()))
+  if 'boxcarWidth' in metadata:
+    header.append('Boxcar width: {0}'.format(metadata['boxcarWidth']))
+  header.append('XAxis mode: Wavelengths')
+  header.append('Number of Pixels in Spectrum: {0}'.format(len(xs)))
+  header.append('>>>>>Begin Spectral Data<<<<<')
+  
+  with open(filePath, 'w') as f:
+    f.write('\n'.join(header) + '\n')
+    f.write(''.join(['{0!r}\t{1!r}\n'.format(x, y) for x, y in zip(xs, ys)]))
+    f.write('>>>>>End Spectral Data<<<<<\n')
+  
+  return
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+import threading
+import numpy as np
+
+### RING BUFFER OF SPECTRA ###
+
+# Preallocated (length x pixels) buffer of the most recent spectra. One thread
+# writes frames, any number of threads read them. Reads return read-only views
+# into the buffer, so they are only valid until the producer wraps around and
+# overwrites the rows - copy them if they have to be kept.
+class SpectrumRingBuffer:
+  def __init__(self, length, pixels=2048, dtype=np.float64):
+    if length < 2:
+      raise ValueError('ring buffer needs at least 2 frames')
+
+    self.length = length
+    self.pixels = pixels
+    # number of frames written since the start (not limited to length)
+    self.count = 0
+    self._buffer = np.zeros((length, pixels), dtype=dtype)
+    self._lock = threading.Lock()
+
+  def write(self, frame):
+    with self._lock:
+      self._buffer[self.count % self.length] = frame
+      self.count += 1
+
+  def clear(self):
+    with self._lock:
+      self.count = 0
+
+  def available(self):
+    return min(self.count, self.length)
+
+  def latest(self):
+    with self._lock:
+      if self.count == 0:
+        return None
+      return self._view(self._buffer[(self.count - 1) % self.length])
+
+  # views of the last k frames in chronological order - one view if the
+  # frames are contiguous in the buffer, two if they wrap around the end
+  def segments(self, k=None):
+    with self._lock:
+      n = self.available()
+      k = n if k is None else min(k, n)
+      if k == 0:
+        return []
+
+      end = self.count % self.length
+      start = end - k
+      if start >= 0:
+        return [self._view(self._buffer[start:end])]
+
+      segments = [self._view(self._buffer[start:])]
+      if end > 0:
+        segments.append(self._view(self._buffer[:end]))
+      return segments
+
+  # mean of the last k frames, computed on the views without stacking them
+  def rollingMean(self, k=None):
+    segments = self.segments(k)
+    if len(segments) == 0:
+      return None
+
+    total = segments[0].sum(axis=0)
+    count = len(segments[0])
+    for segment in segments[1:]:
+      total += segment.sum(axis=0)
+      count += len(segment)
+    return total / count
+
+  # the last k frames as one array (this one is a copy if the frames wrap)
+  def frames(self, k=None):
+    segments = self.segments(k)
+    if len(segments) == 0:
+      return np.empty((0, self.pixels), dtype=self._buffer.dtype)
+    if len(segments) == 1:
+      return segments[0]
+    return np.concatenate(segments)
+
+  def _view(self, array):
+    view = array.view()
+    view.flags.writeable = False
+    return view
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+## Headless acquisition server. Keeps the spectrometer open (wavelengths are
+## calculated once) and serves requests over a local TCP or Unix socket.
+## Run: python wlic.py serve --help
+
+import json
+import time
+import socket
+import struct
+import asyncio
+import logging
+import numpy as np
+from seabreeze.spectrometers import SeaBreezeError
+from asyncspcomm import AsyncSpComm
+
+log = logging.getLogger(__name__)
+
+### MESSAGE FRAMES ###
+
+# Every message, in both directions, is a header followed by a JSON object and
+# a binary payload:
+#   magic 'WLC1', JSON length (uint32), payload length (uint32), little endian
+# The payload holds the arrays named in the JSON 'fields' list, one after the
+# other, as little endian float64 with 'pixels' values each.
+FRAME_MAGIC = b'WLC1'
+FRAME_HEADER = struct.Struct('<4sII')
+FRAME_DTYPE = np.dtype('<f8')
+# larger messages are a protocol error
+MAX_MESSAGE = 64 * 1024 * 1024
+
+DEFAULT_PORT = 7878
+
+SETTINGS = ['integrationTime', 'scansToAverage', 'boxcarWidth', 'correctDarkCounts', 'correctNonlinearity']
+
+class ServerError(Exception):
+  pass
+
+def encodeFrame(message, arrays=()):
+  payload = b''.join([np.ascontiguousarray(array, dtype=FRAME_DTYPE).tobytes() for array in arrays])
+  data = json.dumps(message).encode('utf-8')
+  return FRAME_HEADER.pack(FRAME_MAGIC, len(data), len(payload)) + data + payload
+
+def decodeHeader(header):
+  magic, jsonLength, payloadLength = FRAME_HEADER.unpack(header)
+  if magic != FRAME_MAGIC:
+    raise ServerError('not a WLIC frame')
+  if jsonLength + payloadLength > MAX_MESSAGE:
+    raise ServerError('frame of {0} bytes too large'.format(jsonLength + payloadLength))
+  return jsonLength, payloadLength
+
+# message and {field: array} from the JSON and payload bytes
+def decodeBody(data, payload):
+  try:
+    message = json.loads(data.decode('utf-8'))
+  except ValueError as e:
+    # JSONDecodeError and UnicodeDecodeError
+    raise ServerError('bad message: {0}'.format(e))
+  if not isinstance(message, dict):
+    raise ServerError('message is not a JSON object')
+  values = np.frombuffer(payload, dtype=FRAME_DTYPE)
+  fields = message.get('fields', [])
+  arrays = {}
+  if len(fields) > 0:
+    pixels = len(values) // len(fields)
+    for i, field in enumerate(fields):
+      arrays[field] = values[i*pixels:(i + 1)*pixels]
+  return message, arrays
+
+### SERVER ###
+
+# Serves commands from any number of clients on one spectrometer:
+#   info      serial, settings and the wavelengths ('xs')
+#   settings  changes the default settings, returns them
+#   acquire   one spectrum ('ys', optionally 'std' and 'snr' with 'fields')
+#   stream    'count' spectra (until the client disconnects without a count),
+#             optionally every 'interval' seconds
+# acquire and stream take settings overriding the defaults for that request.
+# Every spectrum is read while holding the device lock; asyncio.Lock wakes its
+# waiters first come, first served, so concurrent clients (and the frames of
+# concurrent streams) take turns fairly.
+class AcquisitionServer:
+  def __init__(self, spectrometer=None, **settings):
+    self.spectrometer = AsyncSpComm() if spectrometer is None else spectrometer
+    self.settings = {
+      'integrationTime': 100000,
+      'scansToAverage': 1,
+      'boxcarWidth': 0,
+      'correctDarkCounts': False,
+      'correctNonlinearity': False
+    }
+    self.settings.update(self._checkSettings(settings))
+    self._servers = []
+    self.clients = 0
+
+  def _checkSettings(self, settings):
+    unknown = [key for key in settings if key not in SETTINGS]
+    if len(unknown) > 0:
+      raise ServerError('unknown settings: {0}'.format(', '.join(unknown)))
+    return settings
+
+  # connects the spectrometer if needed and starts listening on a TCP port
+  # and/or a Unix socket path
+  async def start(self, host='127.0.0.1', port=DEFAULT_PORT, path=None):
+    if self.spectrometer.serialNumber() is None:
+      if not await self.spectrometer.connectToDevice():
+        raise ServerError('no spectrometer found')
+    await self.spectrometer.setIntegrationTime(self.settings['integrationTime'])
+
+    if port is not None:
+      self._servers.append(await asyncio.start_server(self._serveClient, host, port))
+      log.info('listening on %s:%d', host, port)
+    if path is not None:
+      self._servers.append(await asyncio.start_unix_server(self._serveClient, path))
+      log.info('listening on %s', path)
+
+  async def serveForever(self):
+    await asyncio.gather(*[server.serve_forever() for server in self._servers])
+
+  async def close(self):
+    for server in self._servers:
+      server.close()
+      await server.wait_closed()
+    self._servers = []
+    await self.spectrometer.disconnect()
+
+  async def _serveClient(self, reader, writer):
+    self.clients += 1
+    peer = writer.get_extra_info('peername') or 'unix socket'
+    log.info('client %s connected', peer)
+    try:
+      while True:
+        try:
+          header = await reader.readexactly(FRAME_HEADER.size)
+        except asyncio.IncompleteReadError:
+          break
+        jsonLength, payloadLength = decodeHeader(header)
+        data = await reader.readexactly(jsonLength)
+        payload = await reader.readexactly(payloadLength)
+        try:
+          message, arrays = decodeBody(data, payload)
+          await self._handle(message, writer)
+        except (ServerError, ValueError, TypeError, KeyError, SeaBreezeError) as e:
+          # bad requests and errors of the device go back to the client
+          log.info('client %s: %s', peer, e)
+          writer.write(encodeFrame({'error': str(e)}))
+        await writer.drain()
+    except asyncio.IncompleteReadError:
+      log.info('client %s: incomplete message', peer)
+    except ConnectionError as e:
+      log.info('client %s: %s', peer, e)
+    except ServerError as e:
+      # a bad header, the following frames can not be found
+      log.info('client %s: %s', peer, e)
+      writer.write(encodeFrame({'error': str(e)}))
+    finally:
+      self.clients -= 1
+      writer.close()
+      log.info('client %s disconnected', peer)
+
+  async def _handle(self, message, writer):
+    command = message.get('command')
+    params = message.get('params', {})
+
+    if command == 'info':
+      writer.write(encodeFrame({
+        'serial': self.spectrometer.serialNumber(),
+        'pixels': len(self.spectrometer.wavelengths),
+        'settings': self.settings,
+        'clients': self.clients,
+        'fields': ['xs']
+      }, [self.spectrometer.wavelengths]))
+    elif command == 'settings':
+      self.settings.update(self._checkSettings(params))
+      writer.write(encodeFrame({'settings': self.settings}))
+    elif command == 'acquire':
+      settings, fields = self._requestSettings(params)
+      spectrum = await self._acquire(settings)
+      writer.write(self._spectrumFrame(spectrum, settings, fields))
+    elif command == 'stream':
+      settings, fields = self._requestSettings(params)
+      count = params.get('count')
+      interval = params.get('interval')
+      index = 0
+      async for spectrum in self.spectrometer.frames(settings['scansToAverage'], settings['boxcarWidth'], settings['correctDarkCounts'], settings['correctNonlinearity'], interval, count, settings['integrationTime']):
+        writer.write(self._spectrumFrame(spectrum, settings, fields, index))
+        # a slow client slows down its own stream, not the others
+        await writer.drain()
+        index += 1
+      writer.write(encodeFrame({'done': True, 'count': index}))
+    else:
+      raise ServerError('unknown command: {0}'.format(command))
+
+  # request settings over the defaults and the arrays to send
+  def _requestSettings(self, params):
+    params = dict(params)
+    fields = params.pop('fields', ['ys'])
+    for key in ['count', 'interval']:
+      params.pop(key, None)
+    settings = dict(self.settings)
+    settings.update(self._checkSettings(params))
+    for field in fields:
+      if field not in ['ys', 'std', 'snr']:
+        raise ServerError('unknown field: {0}'.format(field))
+    return settings, fields
+
+  async def _acquire(self, settings):
+    timestamp = time.time()
+    spectrum = await self.spectrometer.readSpectrumFromDevice(
+      settings['scansToAverage'],
+      settings['boxcarWidth'],
+      settings['correctDarkCounts'],
+      settings['correctNonlinearity'],
+      integrationTime=settings['integrationTime']
+    )
+    spectrum['timestamp'] = timestamp
+    return spectrum
+
+  def _spectrumFrame(self, spectrum, settings, fields, index=None):
+    message = {
+      'timestamp': spectrum['timestamp'],
+      'scans': spectrum['scans'],
+      'hardwareProcessing': spectrum['hardwareProcessing'],
+      'settings': settings,
+      'fields': fields
+    }
+    if index is not None:
+      message['index'] = index
+    return encodeFrame(message, [spectrum[field] for field in fields])
+
+# runs a server until interrupted
+def serve(host='127.0.0.1', port=DEFAULT_PORT, path=None, **settings):
+  async def run():
+    server = AcquisitionServer(**settings)
+    await server.start(host, port, path)
+    try:
+      await server.serveForever()
+    finally:
+      await server.close()
+
+  try:
+    asyncio.run(run())
+  except KeyboardInterrupt:
+    pass
+
+### CLIENT ###
+
+# Blocking client for scripts, no asyncio needed:
+#   with WlicClient(('127.0.0.1', 7878)) as client:
+#     client.settings(integrationTime=20000)
+#     sp = client.acquire(scansToAverage=10)
+#     for sp in client.stream(count=100):
+#       ...
+# address is a (host, port) tuple or the path of a Unix socket. Spectra are
+# dicts like from readSpectrumFromDevice, with 'xs', 'ys' and the metadata.
+class WlicClient:
+  def __init__(self, address=('127.0.0.1', DEFAULT_PORT), timeout=None):
+    if isinstance(address, str):
+      self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+      self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    self._socket.settimeout(timeout)
+    self._socket.connect(address)
+    self._file = self._socket.makefile('rb')
+    self.wavelengths = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def close(self):
+    self._file.close()
+    self._socket.close()
+
+  def _send(self, command, params):
+    self._socket.sendall(encodeFrame({'command': command, 'params': params}))
+
+  def _receive(self):
+    header = self._file.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+      raise ServerError('connection closed by the server')
+    jsonLength, payloadLength = decodeHeader(header)
+    message, arrays = decodeBody(self._file.read(jsonLength), self._file.read(payloadLength))
+    if 'error' in message:
+      raise ServerError(message['error'])
+    return message, arrays
+
+  def _spectrum(self, message, arrays):
+    if self.wavelengths is None:
+      self.info()
+    spectrum = dict(message)
+    del spectrum['fields']
+    spectrum.update(arrays)
+    spectrum['xs'] = self.wavelengths
+    return spectrum
+
+  # serial, pixels, settings and 'xs'
+  def info(self):
+    self._send('info', {})
+    message, arrays = self._receive()
+    self.wavelengths = arrays['xs']
+    message['xs'] = arrays['xs']
+    del message['fields']
+    return message
+
+  def settings(self, **settings):
+    self._send('settings', settings)
+    return self._receive()[0]['settings']
+
+  # fields: arrays to transfer, of 'ys', 'std', 'snr'
+  def acquire(self, fields=('ys',), **settings):
+    self._send('acquire', dict(settings, fields=list(fields)))
+    return self._spectrum(*self._receive())
+
+  def stream(self, count=None, interval=None, fields=('ys',), **settings):
+    if self.wavelengths is None:
+      self.info()
+    self._send('stream', dict(settings, count=count, interval=interval, fields=list(fields)))
+    while True:
+      message, arrays = self._receive()
+      if message.get('done'):
+        return
+      yield self._spectrum(message, arrays)
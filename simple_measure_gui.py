@@ -11,12 +11,22 @@
 ## 0.2, 13.01.2023
 ##   Fixed three pixels/values of spectrum. Updated light/dark spectra.
 ##   Works for basic measurement. No file saving yet.
-##
+## 0.3
+##   Acquisition runs on a background thread, with a progress bar and
+##   cancelling of the measurement. Integration time can be set to auto.
+##   Live view with fast (blitted) plot updates. Dark spectra are reused from
+##   a library for the same (or interpolated) settings. Timings overlay.
+##   Sample queue: samples with their own settings are measured back to back,
+##   saved (with irradiance) in the background while the next one is measured.
 ##
 
+import os
 import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import ttk
+from tkinter import filedialog
 import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.figure as figure
@@ -26,13 +36,19 @@ from matplotlib.backends.backend_tkagg import (
 )
 from read_files import *
 from spcomm import *
-#from irradiance import *
+from acquisition import *
+from liveplot import *
+from darklibrary import *
+from metrics import metrics
+from irradiance import *
+from masks import *
 import numpy as np
 
 # default values
 _defaults = {
   'integrationTime': 10000, # in microseconds
   'collectionArea': 0.40018986, # in cm^2
+  'calibrationFile': 'USB2+F01701_031209.IrradCal',
   'scansToAverage': 4,
   'boxcarWidth': 0, # to the left and right, for averaging
   'correctDarkCounts': True,
@@ -41,7 +57,8 @@ _defaults = {
 
 _data = {
   'darkSpectrum': None,
-  'lightSpectrum': None
+  'lightSpectrum': None,
+  'darkLibrary': None
 }
 
 def setupWindow():
@@ -73,6 +90,8 @@ def setupWindow():
   app['window'].resizable(width=True, height=True)
   
   app['samples'] = []
+  # results of saving the samples, from the save pool
+  app['sampleResults'] = queue.Queue()
   
   """
   hierarchy of the left panel:
@@ -118,7 +137,7 @@ def setupWindow():
   
   acqTimeLabel = tk.Label(
     spectrometerSettingsFrame,
-    text='time [us]:'
+    text='time [us/auto]:'
   )
   acqTimeLabel.grid(column=0, row=rowIndex, sticky=tk.W)
   
@@ -191,6 +210,22 @@ def setupWindow():
   )
   acqNonLinCorrCheckbox.grid(column=1, row=rowIndex, sticky=tk.W)
   
+  rowIndex += 1
+  liveViewLabel = tk.Label(
+    spectrometerSettingsFrame,
+    text='live view:'
+  )
+  liveViewLabel.grid(column=0, row=rowIndex, sticky=tk.W)
+  app['liveView'] = tk.BooleanVar(app['window'], False)
+  liveViewCheckbox = tk.Checkbutton(
+    spectrometerSettingsFrame,
+    onvalue=1,
+    offvalue=0,
+    variable=app['liveView'],
+    command=liveViewClick
+  )
+  liveViewCheckbox.grid(column=1, row=rowIndex, sticky=tk.W)
+  
   
   ### sample settings ###
   
@@ -219,10 +254,10 @@ def setupWindow():
     text='dir:'
   )
   directoryLabel.grid(column=0, row=rowIndex, sticky=tk.W)
+  app['sampleDirectory'] = tk.StringVar(app['window'], os.getcwd())
   directoryValueLabel = tk.Label(
     sampleSettingsFrame,
-    #textvariable=saveFileData['dir']
-    #textvariable=saveFileData['dir']
+    textvariable=app['sampleDirectory']
   )
   directoryValueLabel.grid(column=1, row=rowIndex, sticky=tk.W)
   
@@ -233,12 +268,50 @@ def setupWindow():
   )
   sampleNameLabel.grid(column=0, row=rowIndex, sticky=tk.W)
   
-  sampleNameTextBox = tk.Text(
+  app['sampleNameTextBox'] = tk.Text(
     sampleSettingsFrame,
     width=20,
     height=1,
   )
-  sampleNameTextBox.grid(column=1, row=rowIndex, sticky=tk.W)
+  app['sampleNameTextBox'].grid(column=1, row=rowIndex, sticky=tk.W)
+  
+  rowIndex += 1
+  addSampleButton = tk.Button(
+    sampleSettingsFrame,
+    text='add sample',
+    borderwidth=1,
+    relief='solid',
+    command=addSample
+  )
+  addSampleButton.grid(column=0, row=rowIndex, sticky=tk.W)
+  
+  removeSampleButton = tk.Button(
+    sampleSettingsFrame,
+    text='remove',
+    borderwidth=1,
+    relief='solid',
+    command=removeSample
+  )
+  removeSampleButton.grid(column=1, row=rowIndex, sticky=tk.E)
+  
+  rowIndex += 1
+  # one line per sample: name, settings and state
+  app['samplesListbox'] = tk.Listbox(
+    sampleSettingsFrame,
+    height=6,
+    width=40
+  )
+  app['samplesListbox'].grid(column=0, row=rowIndex, columnspan=2, sticky=tk.W+tk.E)
+  
+  rowIndex += 1
+  app['measureQueueButton'] = tk.Button(
+    sampleSettingsFrame,
+    text='measure samples',
+    borderwidth=1,
+    relief='solid',
+    command=measureQueueButtonClick
+  )
+  app['measureQueueButton'].grid(column=0, row=rowIndex, columnspan=2, sticky=tk.E)
   
   rowIndex += 1
   app['measureButton'] = tk.Button(
@@ -267,6 +340,15 @@ def setupWindow():
     textvariable=app['infoLabelText']
   )
   infoLabel.grid(column=0, row=rowIndex, sticky=tk.W)
+  
+  rowIndex += 1
+  app['progressBar'] = ttk.Progressbar(
+    sampleSettingsFrame,
+    orient=tk.HORIZONTAL,
+    mode='determinate',
+    maximum=1.0
+  )
+  app['progressBar'].grid(column=0, row=rowIndex, columnspan=2, sticky=tk.W+tk.E)
  
  ### irradiance ###
   
@@ -358,6 +440,8 @@ def setupWindow():
   lgd =  app['axes'].legend(loc=2, bbox_to_anchor=(1., 1.))
   lgd.get_frame().set_edgecolor('white')
   figureCanvas.get_tk_widget().pack(side=tk.TOP)
+  # persistent lines redrawn by blitting
+  app['livePlot'] = LivePlot(app['axes'], maxPoints=4096)
   
   #figureFrame.grid(column=0, row=0)
   
@@ -398,6 +482,26 @@ def setupWindow():
     command=showSpectrumClick
   )
   showDiffSpectrum.grid(column=3, row=0)
+  
+  # per stage timings overlay
+  app['showMetrics'] = tk.BooleanVar(app['window'], False)
+  showMetricsCheckbox = tk.Checkbutton(
+    figureButtonFrame,
+    text='timings',
+    variable=app['showMetrics'],
+    bg='#FFFFFF',
+    command=updateMetricsOverlay
+  )
+  showMetricsCheckbox.grid(column=5, row=0)
+  
+  app['metricsText'] = tk.StringVar(value='')
+  metricsLabel = tk.Label(
+    app['viewFrame'],
+    textvariable=app['metricsText'],
+    justify=tk.LEFT,
+    font=('TkFixedFont', 8)
+  )
+  metricsLabel.grid(column=0, row=2, sticky=tk.W)
   """
   showIrradianceSpectrum = tk.Radiobutton(
     figureButtonFrame,
@@ -418,7 +522,14 @@ def setupWindow():
   
   spectrometer = SpComm()
   spectrometer.connectToDevice()
-  spectrometer.calculateWavelengths()
+  # dark spectra are kept and reused for the same settings
+  _data['darkLibrary'] = DarkLibrary(os.path.join(CONFIG_DIR, 'darklibrary.npz'))
+  
+  # acquisition runs on its own thread, results are polled from the mainloop
+  app['worker'] = AcquisitionWorker()
+  # saving and irradiance of measured samples, while the next one is measured
+  app['savePool'] = ThreadPoolExecutor(max_workers=2, thread_name_prefix='save')
+  app['window'].after(50, pollWorker)
   
   """
   # testing
@@ -435,66 +546,271 @@ def setupWindow():
   app['window'].mainloop()
   
 def selectDirectory():
-  global saveFileData
-  # testing
-  #filename =  tk.filedialog.askopenfilename(initialdir = "/",title = "Select file",filetypes = (("jpeg files","*.jpg"),("all files","*.*")))
-  saveFileData['dir'].set(tk.filedialog.askdirectory())
-  #print(saveFileData['dir'])
-
-def addSample(app, sampleSettingsFrame, rowIndex):
-  global samplesInfoFrame
-  #global samples
-  #global app
-  # add controls
+  global app
   
-  nextCounter = len(app['samples'])
+  directory = filedialog.askdirectory(initialdir=app['sampleDirectory'].get())
+  # empty if the dialog was closed
+  if directory:
+    app['sampleDirectory'].set(directory)
+
+# adds a sample with the name from the text box and the current settings to
+# the queue
+def addSample():
+  global app
   
+  name = app['sampleNameTextBox'].get('1.0', tk.END).strip()
+  # IDs start from 1 and are not reused after removing a sample
+  sampleId = max([sample['id'] for sample in app['samples']], default=0) + 1
   sample = {
+    'id': sampleId,
+    'name': name if name else 'sample{0}'.format(sampleId),
+    'settings': readSettings(),
+    'state': 'queued',
     'measurements': []
   }
+  app['samples'].append(sample)
+  app['samplesListbox'].insert(tk.END, sampleText(sample))
+
+def removeSample():
+  global app
   
-  # IDs start from 1, counter from 0, yea...
-  sample['id'] = nextCounter + 1
+  for index in reversed(app['samplesListbox'].curselection()):
+    # not while it is being measured or saved
+    if app['samples'][index]['state'] not in ('waiting', 'measuring', 'saving'):
+      del app['samples'][index]
+      app['samplesListbox'].delete(index)
+
+def sampleText(sample):
+  settings = sample['settings']
+  integrationTime = settings['integrationTime'] if settings['integrationTime'] == 'auto' else '{0} us'.format(settings['integrationTime'])
+  return '{0} {1}: {2}, {3} sc, {4} boxc - {5}'.format(sample['id'], sample['name'], integrationTime, settings['scansToAverage'], settings['boxcarWidth'], sample['state'])
+
+# position of the sample in the queue, None if it was removed
+def sampleIndex(sample):
+  global app
   
-  sample['labelTextBox'] = tk.Text(
-    sampleSettingsFrame,
-    height=1,
-    width=20
-  )
-  sample['labelTextBox'].grid(column=0, row=rowIndex+nextCounter)
+  for index, other in enumerate(app['samples']):
+    if other is sample:
+      return index
+  return None
+
+def setSampleState(sample, state):
+  global app
   
-  """
-  sample['measureButton'] = tk.Button(
-    samplesInfoFrame,
-    text='meas. s. ' + str(sample['id']),
-    borderwidth=1,
-    relief='solid',
-    #command=lambda: measureSample(nextCounter)
-  )
-  sample['measureButton'].grid(column=1, row=nextCounter, padx=5, pady=2)
-  """
+  sample['state'] = state
+  index = sampleIndex(sample)
+  if index is None:
+    return
+  app['samplesListbox'].delete(index)
+  app['samplesListbox'].insert(index, sampleText(sample))
+
+# Queues all the waiting samples on the acquisition worker, one job each, so
+# they are measured back to back. Each job only acquires; saving and
+# irradiance go to the save pool, so the next sample is measured meanwhile.
+def measureQueueButtonClick():
+  global app
   
-  app['samples'].append(sample)
+  if app['worker'].isBusy():
+    return
+  
+  directory = app['sampleDirectory'].get()
+  regions = readIrradianceRegions()
+  # failed samples are measured again
+  for sample in app['samples']:
+    if sample['state'] != 'queued' and not sample['state'].startswith('error'):
+      continue
+    job = lambda progress, stopEvent, sample=sample: measureSample(sample, directory, regions, progress, stopEvent)
+    app['worker'].submit('sample', job)
+    setSampleState(sample, 'waiting')
+  
+  if app['worker'].isBusy():
+    app['progressBar']['value'] = 0
+    app['infoLabelText'].set('measuring samples')
+    app['measureButton'].config(text='cancel')
+    app['measureDarkButton'].config(state=tk.DISABLED)
 
-def measureButtonClick():
+# runs on the acquisition thread
+def measureSample(sample, directory, regions, progress, stopEvent):
+  global app
   global _data
   
-  sp = getSpectrum()
-  _data['lightSpectrum'] = sp
+  app['sampleResults'].put(('measuring', sample, None))
+  try:
+    sp = getSpectrum(sample['settings'], progress, stopEvent, _data['darkLibrary'])
+  except Exception as e:
+    # the sample can be removed or measured again
+    app['sampleResults'].put(('error', sample, e))
+    raise
+  if 'ys' not in sp:
+    return {'sample': sample}
+  
+  # dark from the library, or the last measured one with the same time
+  dark = sp.get('dark')
+  if dark is None and _data['darkSpectrum'] is not None and _data['darkSpectrum'].get('integrationTime') == sp['integrationTime']:
+    dark = _data['darkSpectrum']
+  
+  sp['sample'] = sample
+  app['sampleResults'].put(('saving', sample, None))
+  app['savePool'].submit(saveSample, sample, sp, dark, directory, regions)
+  return sp
+
+# runs in the save pool: writes the spectrum, and with a dark the dark
+# subtracted spectrum and irradiance; the result goes to sampleResults
+def saveSample(sample, sp, dark, directory, regions):
+  global app
+  global _defaults
   
-  # update plot
-  #updateFigure(sp)
-  showSpectrumClick()
+  try:
+    settings = sample['settings']
+    baseName = os.path.join(directory, '{0}_{1}_{2}us_{3}sc_{4}boxc'.format(sample['id'], sample['name'], sp['integrationTime'], settings['scansToAverage'], settings['boxcarWidth']))
+    writeSpectrumToFile(sp, baseName + '.txt')
+    result = {'file': baseName + '.txt', 'saturated': sp.get('saturated', False)}
+    
+    if dark is not None:
+      writeSpectrumToFile({'xs': sp['xs'], 'ys': sp['ys'] - dark['ys']}, baseName + '_dark-subtracted.txt')
+      if os.path.exists(_defaults['calibrationFile']):
+        engine = getIrradianceEngine(_defaults['calibrationFile'], sp['xs'], _defaults['collectionArea'])
+        irrad = engine.irradiance(sp['ys'], dark['ys'], sp['integrationTime'])
+        writeSpectrumToFile({'xs': sp['xs'], 'ys': irrad}, baseName + '_irradiance.txt')
+        sampleRegions = [dict(region) for region in (regions or [{'min': sp['xs'][0], 'max': sp['xs'][-1]}])]
+        for region, value in zip(sampleRegions, engine.integrateRegions(irrad, sampleRegions)):
+          region['irradiance'] = float(value)
+        if 'mask' in sp:
+          # hot pixels come from the mask of a measured dark
+          mask = sp['mask'] | dark.get('mask', 0)
+          for region, flags in zip(sampleRegions, engine.regionFlags(mask, sampleRegions)):
+            region['flags'] = int(flags)
+        result['regions'] = sampleRegions
+    
+    app['sampleResults'].put(('saved', sample, result))
+  except Exception as e:
+    app['sampleResults'].put(('error', sample, e))
+
+# irradiance regions from the wl limits text boxes, empty if not set
+def readIrradianceRegions():
+  global app
+  
+  try:
+    minLimit = float(app['wlLimitsMinTextBox'].get('1.0', tk.END).strip())
+    maxLimit = float(app['wlLimitsMaxTextBox'].get('1.0', tk.END).strip())
+  except ValueError:
+    return []
+  return [{'min': minLimit, 'max': maxLimit}]
+
+# sample messages from the acquisition thread and the save pool
+def pollSampleResults():
+  global app
+  
+  while True:
+    try:
+      kind, sample, value = app['sampleResults'].get_nowait()
+    except queue.Empty:
+      break
+    
+    # removed from the queue meanwhile
+    if sampleIndex(sample) is None:
+      continue
+    if kind in ('measuring', 'saving'):
+      setSampleState(sample, kind)
+    elif kind == 'saved':
+      sample['measurements'].append(value)
+      state = 'saved'
+      if value['saturated']:
+        state += ', saturated'
+      for region in value.get('regions', []):
+        state += ', {0:.4g} uW/cm2'.format(region['irradiance'])
+        if region.get('flags', 0) & (MASK_SATURATED | MASK_NONLINEAR | MASK_HOT_PIXEL):
+          state += ' ({0})'.format(describeFlags(region['flags']))
+      setSampleState(sample, state)
+    elif kind == 'error':
+      setSampleState(sample, 'error: {0}'.format(value))
+
+def measureButtonClick():
+  global app
+  
+  # the measure button doubles as cancel while acquiring
+  if app['worker'].isBusy():
+    app['worker'].cancel()
+    app['infoLabelText'].set('cancelling')
+    return
+  
+  startMeasurement('lightSpectrum')
   
 def measureDarkButtonClick():
-  global _data
+  global app
   
-  sp = getSpectrum()
-  _data['darkSpectrum'] = sp
+  if app['worker'].isBusy():
+    return
   
-  # update plot
-  #updateFigure(sp)
-  showSpectrumClick()
+  startMeasurement('darkSpectrum')
+
+def startMeasurement(tag):
+  global app
+  
+  settings = readSettings()
+  # dark must be measured with the time found for the light spectrum
+  if tag == 'darkSpectrum' and settings['integrationTime'] == 'auto':
+    settings['integrationTime'] = _s['integrationTime']
+  job = lambda progress, stopEvent: getSpectrum(settings, progress, stopEvent, _data['darkLibrary'], tag == 'darkSpectrum')
+  app['worker'].submit(tag, job)
+  
+  app['progressBar']['value'] = 0
+  app['infoLabelText'].set('measuring')
+  app['measureButton'].config(text='cancel')
+  app['measureDarkButton'].config(state=tk.DISABLED)
+
+def pollWorker():
+  global app
+  global _data
+  
+  # before the worker results, a cancel resets the state of the samples
+  pollSampleResults()
+  
+  while True:
+    try:
+      kind, tag, value = app['worker'].results.get_nowait()
+    except queue.Empty:
+      break
+    
+    if kind == 'progress':
+      app['progressBar']['value'] = value
+      continue
+    
+    # a sample of the queue is shown as the light spectrum
+    if tag == 'sample' and kind == 'done':
+      if 'ys' in value:
+        tag = 'lightSpectrum'
+      else:
+        kind = 'cancelled'
+    
+    if kind == 'done':
+      _data[tag] = value
+      _s['integrationTime'] = value['integrationTime']
+      app['infoLabelText'].set('idle, {0} us'.format(value['integrationTime']))
+      # matching dark from the library, no need to measure it again
+      if 'dark' in value:
+        _data['darkSpectrum'] = value['dark']
+        app['infoLabelText'].set('idle, {0} us, {1} dark'.format(value['integrationTime'], 'interpolated' if value['dark']['interpolated'] else 'stored'))
+      if value.get('saturated'):
+        app['infoLabelText'].set(app['infoLabelText'].get() + ', saturated')
+      # update plot
+      showSpectrumClick()
+    elif kind == 'cancelled':
+      app['infoLabelText'].set('cancelled')
+      for sample in app['samples']:
+        if sample['state'] in ('waiting', 'measuring'):
+          setSampleState(sample, 'queued')
+    elif kind == 'error':
+      app['infoLabelText'].set('error: {0}'.format(value))
+    
+    app['progressBar']['value'] = 0
+    # more samples of the queue still to measure
+    if not app['worker'].isBusy():
+      app['measureButton'].config(text='measure')
+      app['measureDarkButton'].config(state=tk.NORMAL)
+    updateMetricsOverlay()
+  
+  app['window'].after(50, pollWorker)
   
 def calcIrradianceButtonClick():
   global _defaults
@@ -504,45 +820,143 @@ def calcIrradianceButtonClick():
   if _data['lightSpectrum'] == None or _data['darkSpectrum'] == None:
     return
   
-  calibration = readCalibrationFile('USB2+F01701_031209.IrradCal')
-  
-  wlWidths = calcWlWidths(_data['lightSpectrum']['xs'])
-  irrad = calcIrradiance(_data['lightSpectrum'], _data['darkSpectrum'], calibration, _s['integrationTime'], _defaults['collectionArea'], wlWidths)
+  # calibration and bin widths are loaded and calculated only on the first click
+  engine = getIrradianceEngine(_defaults['calibrationFile'], _data['lightSpectrum']['xs'], _defaults['collectionArea'])
+  integrationTime = _data['lightSpectrum'].get('integrationTime', _s['integrationTime'])
+  irrad = engine.irradiance(_data['lightSpectrum']['ys'], _data['darkSpectrum']['ys'], integrationTime)
   
   minLimit = float(app['wlLimitsMinTextBox'].get('1.0', tk.END).strip())
   maxLimit = float(app['wlLimitsMaxTextBox'].get('1.0', tk.END).strip())
   
   regions = [{'min': minLimit, 'max': maxLimit, 'irradiance': 0.0}]
-  regionsIrrad = calcIrradianceForRegions(irrad, regions, wlWidths)
+  for region, value in zip(regions, engine.integrateRegions(irrad, regions)):
+    region['irradiance'] = float(value)
   
-  print (regionsIrrad)
+  # saturated, nonlinear or hot pixels of the light or dark spectrum
+  if 'mask' in _data['lightSpectrum']:
+    mask = _data['lightSpectrum']['mask'] | _data['darkSpectrum'].get('mask', 0)
+    for region, flags in zip(regions, engine.regionFlags(mask, regions)):
+      region['flags'] = int(flags)
+      if flags & (MASK_SATURATED | MASK_NONLINEAR | MASK_HOT_PIXEL):
+        print ('warning: {0} pixels in {1}-{2} nm'.format(describeFlags(flags), region['min'], region['max']))
+    for flagged in flaggedRegions(_data['lightSpectrum']['xs'], mask):
+      print ('{0}: {1:.1f}-{2:.1f} nm'.format(describeFlags(flagged['flags']), flagged['min'], flagged['max']))
   
+  print (regions)
   
-def getSpectrum():
+  
+# reads the settings from the widgets, must run on the main thread
+def readSettings():
   global _s
   global app
-  global spectrometer
   
-  # retrieve and set settings
-  _s['integrationTime'] = int(app['acqTimeTextBox'].get('1.0', tk.END).strip())
+  # 'auto' is resolved by auto-exposure on the acquisition thread
+  integrationTime = app['acqTimeTextBox'].get('1.0', tk.END).strip()
+  if integrationTime != 'auto':
+    integrationTime = int(integrationTime)
+    _s['integrationTime'] = integrationTime
   _s['scansToAverage'] = int(app['acqScansTextBox'].get('1.0', tk.END).strip())
   _s['boxcarWidth'] = int(app['acqBoxcarTextBox'].get('1.0', tk.END).strip())
   #print('measureButtonClick', _s['integrationTime'], _s['scansToAverage'], _s['boxcarWidth'], _s['correctDarkCounts'].get(), _s['correctNonlinearity'].get())
   
+  return {
+    'integrationTime': integrationTime,
+    'scansToAverage': _s['scansToAverage'],
+    'boxcarWidth': _s['boxcarWidth'],
+    'correctDarkCounts': _s['correctDarkCounts'].get(),
+    'correctNonlinearity': _s['correctNonlinearity'].get()
+  }
+
+# runs on the acquisition thread; a dark spectrum is stored in darkLibrary,
+# from a light spectrum a matching dark from the library is subtracted
+def getSpectrum(settings, callback=None, stopEvent=None, darkLibrary=None, isDark=False):
+  global spectrometer
+  
+  integrationTime = settings['integrationTime']
+  if integrationTime == 'auto':
+    integrationTime = spectrometer.optimizeIntegrationTime(correctDarkCounts=settings['correctDarkCounts'], correctNonlinearity=settings['correctNonlinearity'])
+  
   # get spectrum
-  spectrometer.setIntegrationTime(_s['integrationTime'])
-  time.sleep(float(_s['integrationTime'] / 1000000))
-  sp = spectrometer.readSpectrumFromDevice(_s['scansToAverage'], _s['boxcarWidth'], _s['correctDarkCounts'].get(), _s['correctNonlinearity'].get())
+  spectrometer.setIntegrationTime(integrationTime)
+  # wait for the spectrometer to collect a spectrum with the new setting
+  delay = float(integrationTime / 1000000)
+  if stopEvent is None:
+    time.sleep(delay)
+  elif stopEvent.wait(delay):
+    return {}
+  # hot pixels are only looked for in the dark
+  sp = spectrometer.readSpectrumFromDevice(settings['scansToAverage'], settings['boxcarWidth'], settings['correctDarkCounts'], settings['correctNonlinearity'], callback, stopEvent, isDark=isDark)
+  sp['integrationTime'] = integrationTime
+  
+  if darkLibrary is not None and 'ys' in sp:
+    darkSettings = (spectrometer.serialNumber(), integrationTime, settings['scansToAverage'], settings['correctDarkCounts'], settings['correctNonlinearity'])
+    if isDark:
+      darkLibrary.store(*darkSettings, sp['ys'], mask=sp.get('mask'))
+    else:
+      dark = darkLibrary.lookup(*darkSettings)
+      if dark is not None:
+        dark['xs'] = sp['xs']
+        sp['dark'] = dark
+        sp['darkSubtractedYs'] = sp['ys'] - dark['ys']
   
   return sp
   
-def updateFigure(data):
+def updateFigure(data, name='spectrum'):
+  global app
+  
+  with metrics.timer('plotUpdate'):
+    app['livePlot'].update(name, data['xs'], data['ys'])
+
+def updateMetricsOverlay():
   global app
   
-  app['axes'].cla()
-  app['axes'].plot(data['xs'], data['ys'], marker='', linewidth=0.5)
-  app['figure'].canvas.draw()
-  app['figure'].canvas.flush_events()
+  if app['showMetrics'].get():
+    app['metricsText'].set(metrics.overlayText())
+  else:
+    app['metricsText'].set('')
+
+def liveViewClick():
+  global app
+  global spectrometer
+  
+  if not app['liveView'].get():
+    spectrometer.stopContinuous()
+    app['livePlot'].clear()
+    showSpectrumClick()
+    return
+  
+  if app['worker'].isBusy():
+    app['liveView'].set(False)
+    return
+  
+  settings = readSettings()
+  if settings['integrationTime'] != 'auto':
+    spectrometer.setIntegrationTime(settings['integrationTime'])
+  spectrometer.startContinuous(10, settings['correctDarkCounts'], settings['correctNonlinearity'])
+  app['liveFrameCount'] = 0
+  app['livePlot'].clear()
+  liveViewTick()
+
+# shows the newest frame of the free-run mode, ~30 times per second
+def liveViewTick():
+  global app
+  global spectrometer
+  
+  if not spectrometer.isContinuous():
+    # stopped by a read error
+    if spectrometer.continuousError is not None:
+      app['liveView'].set(False)
+      app['infoLabelText'].set('live view stopped: {0}'.format(spectrometer.continuousError))
+    return
+  
+  buffer = spectrometer.continuousBuffer
+  if buffer.count != app['liveFrameCount']:
+    app['liveFrameCount'] = buffer.count
+    updateFigure({'xs': spectrometer.wavelengths, 'ys': np.array(buffer.latest())}, 'live')
+    if buffer.count % 30 == 0:
+      updateMetricsOverlay()
+  
+  app['window'].after(30, liveViewTick)
   
 def showSpectrumClick():
   global app
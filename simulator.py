@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+import os
+import time
+import zlib
+import threading
+import numpy as np
+from read_files import *
+from spcomm import MAX_COUNTS, DEFAULT_WAVELENGTH_COEFFICIENTS, DEFAULT_PIXELS
+
+### SIMULATED SPECTROMETERS ###
+
+# Stand-ins for seabreeze Spectrometer, for benchmarking and testing without
+# hardware. Use them with SpComm.attachSpectrometer() or set the WLIC_SIMULATOR
+# environment variable before SpComm.connectToDevice().
+
+# EEPROM with the wavelength coefficients in slots 1-4, like a real device
+class _SimulatedEeprom:
+  def __init__(self, coefficients):
+    self._coefficients = coefficients
+
+  def eeprom_read_slot(self, slot):
+    if 1 <= slot <= len(self._coefficients):
+      return '{0:E}'.format(self._coefficients[slot - 1]).encode('ascii') + b'\x00'
+    return b'\x00'
+
+# serial number derived from what makes the device different, so simulated
+# devices with other axes do not share cached wavelengths
+def _simulatedSerial(prefix, *parts):
+  return '{0}{1:08X}'.format(prefix, zlib.crc32(repr(parts).encode('utf-8')))
+
+class _SimulatedFeatures:
+  def __init__(self, coefficients):
+    self.eeprom = _SimulatedEeprom(coefficients)
+
+class _SimulatedBase:
+  minimum_integration_time_micros = 1000
+  maximum_integration_time_micros = 65000000
+
+  def __init__(self, serial, coefficients, pixels, realtime, readoutLatency):
+    self.serial_number = serial
+    self.pixels = pixels
+    self.max_intensity = MAX_COUNTS - 1
+    self.f = _SimulatedFeatures(coefficients)
+    # with realtime=False frames are returned immediately
+    self.realtime = realtime
+    self.readoutLatency = readoutLatency
+    self._integrationTime = 10000
+    self._lastFrame = None
+    self._lock = threading.Lock()
+    self._wavelengths = np.polyval(list(coefficients)[::-1], np.arange(0, pixels, dtype=np.float64))
+
+  def integration_time_micros(self, integrationTime):
+    if not self.minimum_integration_time_micros <= integrationTime <= self.maximum_integration_time_micros:
+      raise ValueError('integration time out of range: {0}'.format(integrationTime))
+    self._integrationTime = int(integrationTime)
+
+  def wavelengths(self):
+    return self._wavelengths.copy()
+
+  def close(self):
+    pass
+
+  # frames follow each other at the integration time plus readout, like a
+  # free running detector
+  def _waitForFrame(self):
+    if not self.realtime:
+      return
+    period = self._integrationTime / 1000000 + self.readoutLatency
+    with self._lock:
+      now = time.monotonic()
+      due = now + period if self._lastFrame is None else max(self._lastFrame + period, now)
+      self._lastFrame = due
+    time.sleep(max(due - now, 0.0))
+
+# Model of a USB2000+ looking at a lamp: signal proportional to integration
+# time, shot and read noise, dark current, electrical dark offset, detector
+# nonlinearity and saturation at MAX_COUNTS.
+class SimulatedSpectrometer(_SimulatedBase):
+  model = 'USB2000PLUS'
+
+  def __init__(self, serial=None, source=None, coefficients=DEFAULT_WAVELENGTH_COEFFICIENTS, pixels=DEFAULT_PIXELS, realtime=True, readoutLatency=0.004, electricalDark=1500., darkCurrent=0.02, readNoise=8., nonlinearity=0.05, seed=None):
+    if serial is None:
+      serial = _simulatedSerial('SIM', pixels, [float(c) for c in coefficients])
+    _SimulatedBase.__init__(self, serial, coefficients, pixels, realtime, readoutLatency)
+    self._rng = np.random.default_rng(seed)
+    self.electricalDark = electricalDark
+    # counts/ms
+    self.darkCurrent = darkCurrent
+    self.readNoise = readNoise
+    self.nonlinearity = nonlinearity
+    # counts/ms per pixel
+    self.source = self.defaultSource(self._wavelengths) if source is None else np.asarray(source, dtype=np.float64)
+
+  # broad continuum with a few emission lines, peaks at ~2000 counts/ms
+  @staticmethod
+  def defaultSource(wavelengths):
+    continuum = 600. * np.exp(-0.5 * ((wavelengths - 600.) / 120.)**2)
+    lines = np.zeros_like(wavelengths)
+    for center, height, width in ((435.8, 1400., 1.2), (546.1, 2000., 1.2), (611.6, 900., 1.5)):
+      lines += height * np.exp(-0.5 * ((wavelengths - center) / width)**2)
+    return continuum + lines
+
+  def intensities(self, correct_dark_counts=False, correct_nonlinearity=False):
+    self._waitForFrame()
+
+    t = self._integrationTime / 1000
+    electrons = (self.source + self.darkCurrent) * t
+    # shot noise, normal approximation of Poisson
+    signal = electrons + np.sqrt(electrons) * self._rng.standard_normal(self.pixels)
+    signal += self.readNoise * self._rng.standard_normal(self.pixels)
+
+    # the detector response bends down towards full well
+    counts = signal * (1. - self.nonlinearity * signal / MAX_COUNTS) + self.electricalDark
+    counts = np.clip(counts, 0., MAX_COUNTS - 1)
+
+    if correct_dark_counts:
+      counts -= self.electricalDark
+    if correct_nonlinearity:
+      # inverse of the response curve, saturated pixels stay saturated
+      linear = counts - (0. if correct_dark_counts else self.electricalDark)
+      discriminant = np.clip(1. - 4. * self.nonlinearity * linear / MAX_COUNTS, 0., None)
+      linear = (1. - np.sqrt(discriminant)) * MAX_COUNTS / (2. * self.nonlinearity)
+      counts = np.where(counts >= MAX_COUNTS - 1, counts, linear + (0. if correct_dark_counts else self.electricalDark))
+
+    return counts
+
+# Replays recorded OceanView spectra in a loop, scaled by the ratio of the
+# current to the recorded integration time if that is given.
+class ReplaySpectrometer(_SimulatedBase):
+  model = 'REPLAY'
+
+  def __init__(self, files, serial=None, recordedIntegrationTime=None, realtime=True, readoutLatency=0.004):
+    spectra = [readSpectrumFromFile(filename) for filename in files]
+    if len(spectra) == 0:
+      raise ValueError('no files to replay')
+
+    xs = spectra[0]['xs']
+    # cubic fit of the recorded axis, served through the simulated EEPROM
+    coefficients = list(np.polyfit(np.arange(0, len(xs), dtype=np.float64), xs, 3)[::-1])
+    if serial is None:
+      serial = _simulatedSerial('REPLAY', len(xs), [float(c) for c in coefficients], [os.path.abspath(filename) for filename in files])
+    _SimulatedBase.__init__(self, serial, coefficients, len(xs), realtime, readoutLatency)
+
+    self.frames = np.array([spectrum['ys'] for spectrum in spectra], dtype=np.float64)
+    self.recordedIntegrationTime = recordedIntegrationTime
+    self._next = 0
+
+  def intensities(self, correct_dark_counts=False, correct_nonlinearity=False):
+    self._waitForFrame()
+
+    with self._lock:
+      frame = self.frames[self._next % len(self.frames)]
+      self._next += 1
+
+    if self.recordedIntegrationTime:
+      frame = np.clip(frame * self._integrationTime / self.recordedIntegrationTime, 0., MAX_COUNTS - 1)
+    return frame.copy()
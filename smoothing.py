@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+import numpy as np
+
+### SMOOTHING ###
+
+# All the filters work along `axis` of 1-D or N-D arrays (for example one
+# spectrum per row) and keep the length of the data. The width is the number of
+# pixels to the left and right, the window has 2*width+1 pixels - the same as
+# the boxcar width of OceanView.
+
+def _padLastAxis(ys, width, mode):
+  padding = [(0, 0)] * (ys.ndim - 1) + [(width, width)]
+  return np.pad(ys, padding, mode=mode)
+
+# sum of kernel[j] * ys[i - width + j]; memory stays at the size of the data,
+# no window views are materialized
+def _correlate(ys, kernel):
+  width = len(kernel) // 2
+  n = ys.shape[-1]
+  padded = _padLastAxis(ys, width, 'constant')
+  out = np.zeros(ys.shape, dtype=np.float64)
+  for j in range(0, len(kernel)):
+    out += kernel[j] * padded[..., j:j + n]
+  return out
+
+# Boxcar average computed from cumulative sums, O(n) whatever the width.
+# edges='shrink' averages only the pixels inside the data near the edges,
+# edges='reflect' mirrors the data at the edges. Both avoid the bias towards
+# zero of convolution with zero padding.
+def boxcar(ys, width, axis=-1, edges='shrink'):
+  ys = np.moveaxis(np.asarray(ys, dtype=np.float64), axis, -1)
+  n = ys.shape[-1]
+  if width <= 0 or n == 0:
+    return np.moveaxis(ys.copy(), -1, axis)
+
+  window = 2*width + 1
+  if edges == 'reflect':
+    if width >= n:
+      raise ValueError('boxcar width {0} too large for {1} pixels'.format(width, n))
+    ys = _padLastAxis(ys, width, 'reflect')
+  elif edges != 'shrink':
+    raise ValueError('unknown edge handling: {0}'.format(edges))
+
+  cumulative = np.zeros(ys.shape[:-1] + (ys.shape[-1] + 1,))
+  np.cumsum(ys, axis=-1, out=cumulative[..., 1:])
+
+  if edges == 'reflect':
+    out = (cumulative[..., window:] - cumulative[..., :-window]) / window
+  else:
+    i = np.arange(0, n)
+    starts = np.clip(i - width, 0, n)
+    ends = np.clip(i + width + 1, 0, n)
+    out = (cumulative[..., ends] - cumulative[..., starts]) / (ends - starts)
+
+  return np.moveaxis(out, -1, axis)
+
+# least squares polynomial fits over the window, the edge pixels are taken
+# from the polynomial fitted to the first and last full window
+def savitzkyGolay(ys, width, order=2, axis=-1):
+  ys = np.moveaxis(np.asarray(ys, dtype=np.float64), axis, -1)
+  n = ys.shape[-1]
+  window = 2*width + 1
+  if width <= 0:
+    return np.moveaxis(ys.copy(), -1, axis)
+  if order >= window:
+    raise ValueError('polynomial order must be smaller than the window')
+  if window > n:
+    raise ValueError('window of {0} pixels larger than the data'.format(window))
+
+  x = np.arange(-width, width + 1, dtype=np.float64)
+  # rows: polynomial coefficients from the values in the window
+  fit = np.linalg.pinv(np.vander(x, order + 1, increasing=True))
+
+  out = _correlate(ys, fit[0])
+  left = np.vander(x[:width], order + 1, increasing=True) @ fit
+  right = np.vander(x[width + 1:], order + 1, increasing=True) @ fit
+  out[..., :width] = ys[..., :window] @ left.T
+  out[..., n - width:] = ys[..., n - window:] @ right.T
+
+  return np.moveaxis(out, -1, axis)
+
+# Gaussian kernel truncated at `truncate` sigmas; near the edges the kernel is
+# renormalized to the part inside the data
+def gaussian(ys, sigma, axis=-1, truncate=4.0):
+  ys = np.moveaxis(np.asarray(ys, dtype=np.float64), axis, -1)
+  n = ys.shape[-1]
+  width = int(truncate * sigma + 0.5)
+  if sigma <= 0 or width == 0 or n == 0:
+    return np.moveaxis(ys.copy(), -1, axis)
+
+  x = np.arange(-width, width + 1, dtype=np.float64)
+  kernel = np.exp(-0.5 * (x / sigma)**2)
+  kernel /= kernel.sum()
+
+  out = _correlate(ys, kernel)
+  out /= _correlate(np.ones(n), kernel)
+
+  return np.moveaxis(out, -1, axis)
+
+# method is 'boxcar', 'savitzkyGolay' or 'gaussian'; width is the half width
+# in pixels (sigma for gaussian)
+def smooth(ys, width, method='boxcar', axis=-1, **options):
+  if method == 'boxcar':
+    return boxcar(ys, width, axis, **options)
+  if method == 'savitzkyGolay':
+    return savitzkyGolay(ys, width, axis=axis, **options)
+  if method == 'gaussian':
+    return gaussian(ys, width, axis, **options)
+  raise ValueError('unknown smoothing method: {0}'.format(method))
@@ -6,68 +6,209 @@
 ## Description: Part of WLIC - simple GUI program for collecting spectra from
 ##              spectrometer.
 
+import os
+import time
+import logging
 import seabreeze
-from seabreeze.spectrometers import list_devices, Spectrometer
+from seabreeze.spectrometers import list_devices, Spectrometer, SeaBreezeError
 import numpy as np
+import threading
+from ringbuffer import SpectrumRingBuffer
+from accumulator import SpectrumAccumulator
+from read_files import readFileSimple
+from smoothing import boxcar
+from masks import PixelMask, dilateMask, MASK_HOT_PIXEL
+from metrics import metrics
 
 ### SPECTROMETER COMMUNICATION ###
+log = logging.getLogger(__name__)
+
 MAX_COUNTS = 2**16
 MAX_INTENSITY = MAX_COUNTS * 0.85
+# pixels above this fraction of the full scale are flagged saturated; with
+# electric dark correction the levels are lowered by the subtracted counts
+# (see electricDarkLevel)
+SATURATION_FRACTION = 0.98
+
+# USB2000+ coeficients for wavelength calculation (intercept, 1st, 2nd and 3rd
+# order), used when neither a config file nor the device provide them
+DEFAULT_WAVELENGTH_COEFFICIENTS = [177.40000, 3.80800E-1, -1.40759E-5, -2.36589E-9]
+DEFAULT_PIXELS = 2048
+# per device coefficient files <serial>.wlcoef, one coefficient per line
+CONFIG_DIR = os.path.join(os.path.expanduser('~'), '.wlic')
 
+# wavelengths per (serial number, pixels), calculated once and shared (read-only)
+_wavelengthCache = {}
+
+# SpComm talks to the spectrometer through the seabreeze Spectrometer
+# interface: integration_time_micros(t), intensities(correctDarkCounts,
+# correctNonlinearity), serial_number, pixels, close() and optionally
+# f.eeprom.eeprom_read_slot(slot). Any object providing these can be used as a
+# backend (see simulator.py), connect it with attachSpectrometer().
 class SpComm:
   _sp = None
   wavelengths = []
+  # average and smooth on the device when it supports it
+  useHardwareProcessing = True
+  
+  def __init__(self):
+    # serializes device access between one-shot reads and the free-run thread
+    self._lock = threading.RLock()
+    self._continuousThread = None
+    self._continuousStop = threading.Event()
+    self.continuousBuffer = None
+    # exception that ended the free-run mode, None while it runs
+    self.continuousError = None
+    self._electricDark = None
+    self._resetHardwareProcessing()
   
-  def connectToDevice(self):
+  # connects to the given device (from list_devices()) or the first available;
+  # with WLIC_SIMULATOR set to 1 to a simulated spectrometer, or set to a glob
+  # pattern of OceanView files to a spectrometer replaying them
+  def connectToDevice(self, device=None):
+    simulator = os.environ.get('WLIC_SIMULATOR')
+    if device is None and simulator:
+      import glob
+      from simulator import SimulatedSpectrometer, ReplaySpectrometer
+      if simulator == '1':
+        self.attachSpectrometer(SimulatedSpectrometer())
+      else:
+        self.attachSpectrometer(ReplaySpectrometer(sorted(glob.glob(simulator))))
+      return True
+    
+    if device is not None:
+      self.attachSpectrometer(Spectrometer(device))
+      return True
+    
     devices = list_devices()
     if len(devices) == 0:
       return False
     
-    self._sp = Spectrometer.from_first_available()
-    self.calculateWavelengths()
+    self.attachSpectrometer(Spectrometer.from_first_available())
     return True
 
+  def attachSpectrometer(self, spectrometer):
+    self._sp = spectrometer
+    self._electricDark = None
+    self._resetHardwareProcessing()
+    self.calculateWavelengths()
+
+  def disconnect(self):
+    self.stopContinuous()
+    if self._sp is not None:
+      self._sp.close()
+      self._sp = None
+
+  def serialNumber(self):
+    if self._sp is None:
+      return None
+    return self._sp.serial_number
+
   def calculateWavelengths(self):
-    # USB2000+ coeficients for wavelength calculation
-    intercept = 177.40000
-    coef1 = 3.80800E-1
-    coef2 = -1.40759E-5
-    coef3 = -2.36589E-9
-    self.wavelengths = list(map(lambda x: intercept + coef1*x + coef2*x**2 + coef3*x**3, range(0, 2048)))
-
-  # testing
-  def optimizeIntegrationTime(self):
-    tStart = 1000 # usec
-    tEnd = 1000000
-    tStep = 1000
-    tOptimal = tStart
-    """
-    tRange = [t for t in range(1, 10, 1)]
-    tRange.extend([t for t in range(1*10, 10*10, 1*10)])
-    tRange.extend([t for t in range(1*100, 11*100, 1*100)])
-    """
-    tRange = [t for t in range(1, 6, 1)]
-    t = 6.0
-    while t <= 1000:
-      tRange.append(round(t))
-      t = round(t)*1.2
-    print (tRange)
-    
-    for t in tRange:
-      self.setIntegrationTime(t*1000)
-      sp = self.readSpectrumFromDevice(1)
-      if np.amax(sp['ys']) > MAX_INTENSITY:
-        # choose the last int. time and break
+    serial = self.serialNumber()
+    pixels = self._sp.pixels if self._sp is not None else DEFAULT_PIXELS
+    key = (serial, pixels)
+    if key in _wavelengthCache:
+      self.wavelengths = _wavelengthCache[key]
+      return
+    
+    coefficients = self.readWavelengthCoefficients()
+    # np.polyval wants the highest order first
+    wavelengths = np.polyval(coefficients[::-1], np.arange(0, pixels, dtype=np.float64))
+    wavelengths.flags.writeable = False
+    
+    _wavelengthCache[key] = wavelengths
+    self.wavelengths = wavelengths
+
+  # wavelength polynomial coefficients, lowest order first: from the config
+  # file for this serial, from the device EEPROM or the USB2000+ defaults
+  def readWavelengthCoefficients(self):
+    serial = self.serialNumber()
+    if serial is None:
+      return DEFAULT_WAVELENGTH_COEFFICIENTS
+    
+    configFile = os.path.join(CONFIG_DIR, '{0}.wlcoef'.format(serial))
+    if os.path.exists(configFile):
+      return list(readFileSimple(configFile))
+    
+    # EEPROM slots 1-4 hold the coefficients as ASCII numbers
+    try:
+      coefficients = []
+      for slot in range(1, 5):
+        raw = self._sp.f.eeprom.eeprom_read_slot(slot)
+        coefficients.append(float(raw.split(b'\x00')[0].decode('ascii').strip()))
+      return coefficients
+    except (AttributeError, ValueError, SeaBreezeError):
+      return DEFAULT_WAVELENGTH_COEFFICIENTS
+
+  # model based auto-exposure: counts grow linearly with the integration time,
+  # so a probe is extrapolated to the time giving the target peak; saturated
+  # or missed steps are refined by bisection between the longest time below
+  # the target and the shortest one above it; returns the time in us
+  def optimizeIntegrationTime(self, target=MAX_INTENSITY, tolerance=0.1, maxReads=6, tMin=None, tMax=1000000, correctDarkCounts=False, correctNonlinearity=False):
+    if tMin is None:
+      tMin = max(1000, getattr(self._sp, 'minimum_integration_time_micros', 1000))
+    
+    # aim for the middle of the accepted band [target*(1-tolerance), target]
+    aim = target * (1 - tolerance/2)
+    tBelow = None
+    tAbove = None
+    t = min(max(10000, tMin), tMax)
+    
+    for step in range(0, maxReads):
+      peak, baseline = self._probeIntegrationTime(t, correctDarkCounts, correctNonlinearity)
+      log.info('auto-exposure step %d: %d us, peak %.0f, baseline %.0f', step + 1, t, peak, baseline)
+      
+      tNext = None
+      if peak < target:
+        tBelow = t
+        if peak >= target * (1 - tolerance) or t >= tMax:
+          break
+        rate = (peak - baseline) / t
+        if rate > 0:
+          tNext = (aim - baseline) / rate
+        else:
+          tNext = tMax
+      else:
+        tAbove = t
+        if t <= tMin:
+          break
+      
+      # keep the next step inside the bracket, bisect if it is not
+      if tAbove is not None:
+        if tBelow is None:
+          tNext = t / 4
+        elif tNext is None or not tBelow < tNext < tAbove:
+          tNext = (tBelow + tAbove) / 2
+      
+      tNext = int(min(max(round(tNext), tMin), tMax))
+      if tNext == t or (tBelow is not None and tAbove is not None and tAbove - tBelow <= tMin):
         break
-      tOptimal = t * 1000
+      t = tNext
     
-    print ('tOptimal', tOptimal)
+    tOptimal = tBelow if tBelow is not None else tMin
+    log.info('auto-exposure result: %d us', tOptimal)
     return tOptimal
 
+  # peak and baseline counts of a single scan at integration time t
+  def _probeIntegrationTime(self, t, correctDarkCounts, correctNonlinearity):
+    self.setIntegrationTime(t)
+    # the first spectrum after the change may still use the old setting
+    time.sleep(t / 1000000)
+    sp = self.readSpectrumFromDevice(1, 0, correctDarkCounts, correctNonlinearity)
+    return np.amax(sp['ys']), np.percentile(sp['ys'], 1)
+
   def setIntegrationTime(self, integrationTime):
-    self._sp.integration_time_micros(integrationTime)
+    with self._lock:
+      self._sp.integration_time_micros(integrationTime)
 
-  def readSpectrumFromDevice(self, scansToAverage=1, boxcarWidth=0, correctDarkCounts=False, correctNonlinearity=False, callback=None):
+  # Besides the averaged 'ys' returns 'mask', a uint8 bitmask per pixel (see
+  # masks.py) of saturated, nonlinear, hot and fixed pixels. Hot pixels are
+  # found when reading a dark (isDark); for a light spectrum they can be passed
+  # as hotPixels (boolean array), e.g. from the 'mask' of the dark. With
+  # rejectSaturated averaging stops at the first saturated scan and the result
+  # has 'rejected' set.
+  def readSpectrumFromDevice(self, scansToAverage=1, boxcarWidth=0, correctDarkCounts=False, correctNonlinearity=False, callback=None, stopEvent=None, rejectSaturated=False, isDark=False, hotPixels=None):
     # for testing:
     #return readSpectrumFromFile(os.path.join(dir, '5_uv-vis/counts.txt'))
     #return {'xs': np.linspace(180., 800., num=2048), 'ys': np.random.default_rng().integers(low=500, high=50000, size=2048)}
@@ -80,34 +221,275 @@ class SpComm:
     #wavelengths = self._sp.wavelengths()
     #print (wavelengths[-10:])
     
-    scans = []
+    # average (and smooth) on the device, a single spectrum is transferred
+    hardware = self.useHardwareProcessing and (scansToAverage > 1 or boxcarWidth > 0)
+    if hardware:
+      hardware = self._setHardwareProcessing(scansToAverage, boxcarWidth)
+    else:
+      self._setHardwareProcessing(1, 0)
+    
+    # running mean and variance, memory does not grow with the number of scans
+    scans = SpectrumAccumulator(len(self.wavelengths))
+    saturationLevel, nonlinearLevel = self._maskLevels(correctDarkCounts)
+    mask = PixelMask(len(self.wavelengths), saturationLevel, nonlinearLevel, isDark, hotPixels)
+    rejected = False
     
-    for i in range(0, scansToAverage):
+    for i in range(0, 1 if hardware else scansToAverage):
+      # cancelled from another thread
+      if stopEvent is not None and stopEvent.is_set():
+        return {}
+      
       # get intensities - counts in spectrometertraSuite
-      #t = timeit.default_timer()
-      rawInt = self._sp.intensities(correctDarkCounts, correctNonlinearity)
-      #log('single spectrum acq t: {0}'.format(timeit.default_timer() - t))
+      # the time waiting for the device lock is not part of the read
+      with self._lock:
+        with metrics.timer('usbRead'):
+          rawInt = self._sp.intensities(correctDarkCounts, correctNonlinearity)
       #spectrum = readSpectrumFromFile('counts_1_100ms.txt')
       #print (rawInt)
       
-      scans.append(rawInt)
+      with metrics.timer('accumulate'):
+        scans.add(rawInt)
+      # of an average from the device only pixels saturated in (nearly) all
+      # scans can be seen
+      with metrics.timer('mask'):
+        saturated = mask.add(rawInt)
       if callback:
-        callback((i+1)/scansToAverage)
-   
-    # average the spectrum
-    intensities = np.average(scans, axis=0)
+        callback((i+1)/scansToAverage if not hardware else 1.0)
+      
+      # no point in averaging more scans with bad settings
+      if saturated and rejectSaturated:
+        rejected = True
+        break
+    
+    return self._finishSpectrum(scans, mask, boxcarWidth, hardware, rejected, scansToAverage if hardware else scans.count)
+
+  # Averages scans until the median SNR over wlMin-wlMax reaches targetSnr (or
+  # the relative standard error drops to targetRelativeError), the time budget
+  # (s) runs out or maxScans are read. The signal is counts minus the dark
+  # (spectrum dict or ys) if given; the noise of the dark is not included.
+  # Returns the readSpectrumFromDevice result with 'achievedSnr', 'targetSnr',
+  # 'targetReached' and 'elapsed'. Averaging is always done on the host, the
+  # SNR is checked after every scan.
+  def readSpectrumAdaptive(self, targetSnr=None, targetRelativeError=None, wlMin=None, wlMax=None, timeBudget=10., dark=None, minScans=2, maxScans=100000, boxcarWidth=0, correctDarkCounts=False, correctNonlinearity=False, callback=None, stopEvent=None, rejectSaturated=False):
+    if targetSnr is None:
+      if targetRelativeError is None:
+        raise ValueError('targetSnr or targetRelativeError is needed')
+      targetSnr = 1 / targetRelativeError
+    
+    self._setHardwareProcessing(1, 0)
+    window = self.wavelengthSlice(wlMin, wlMax)
+    background = None
+    hotPixels = None
+    if dark is not None:
+      background = np.asarray(dark['ys'] if isinstance(dark, dict) else dark, dtype=np.float64)[window]
+      # hot pixels are known from the mask of a dark
+      if isinstance(dark, dict) and 'mask' in dark:
+        hotPixels = (np.asarray(dark['mask']) & MASK_HOT_PIXEL) != 0
+    
+    scans = SpectrumAccumulator(len(self.wavelengths))
+    saturationLevel, nonlinearLevel = self._maskLevels(correctDarkCounts)
+    mask = PixelMask(len(self.wavelengths), saturationLevel, nonlinearLevel, hotPixels=hotPixels)
+    rejected = False
+    achieved = 0.0
+    start = time.monotonic()
+    
+    while scans.count < maxScans:
+      if stopEvent is not None and stopEvent.is_set():
+        return {}
+      
+      # the time waiting for the device lock is not part of the read
+      with self._lock:
+        with metrics.timer('usbRead'):
+          rawInt = self._sp.intensities(correctDarkCounts, correctNonlinearity)
+      with metrics.timer('accumulate'):
+        scans.add(rawInt)
+      with metrics.timer('mask'):
+        saturated = mask.add(rawInt)
+      elapsed = time.monotonic() - start
+      
+      if saturated and rejectSaturated:
+        rejected = True
+        break
+      
+      if scans.count >= minScans:
+        # flagged pixels would report a meaningless SNR
+        achieved = scans.windowSnr(window, background, mask.mask()[window] != 0)
+        if achieved >= targetSnr:
+          break
+      
+      # SNR grows with the square root of the number of scans
+      if callback:
+        callback(min(max(elapsed / timeBudget, (achieved / targetSnr)**2), 1.0))
+      
+      # the next scan would not fit in the budget
+      if elapsed / scans.count * (scans.count + 1) > timeBudget:
+        break
+    
+    log.info('adaptive averaging: %d scans, SNR %.1f of %.1f in %.2f s', scans.count, achieved, targetSnr, time.monotonic() - start)
+    spectrum = self._finishSpectrum(scans, mask, boxcarWidth, False, rejected, scans.count)
+    spectrum['achievedSnr'] = achieved
+    spectrum['targetSnr'] = targetSnr
+    spectrum['targetReached'] = achieved >= targetSnr
+    spectrum['elapsed'] = time.monotonic() - start
+    return spectrum
+
+  # pixel range of the wavelengths between wlMin and wlMax (nm)
+  def wavelengthSlice(self, wlMin=None, wlMax=None):
+    start = 0 if wlMin is None else int(np.searchsorted(self.wavelengths, wlMin, side='left'))
+    stop = len(self.wavelengths) if wlMax is None else int(np.searchsorted(self.wavelengths, wlMax, side='right'))
+    return slice(start, stop)
+
+  # spectrum dict from the averaged scans: pixel fixup, boxcar and mask
+  def _finishSpectrum(self, scans, mask, boxcarWidth, hardware, rejected, scanCount):
+    # average the spectrum, once per read
+    with metrics.timer('average'):
+      intensities = scans.mean()
+      std = scans.std()
+      snr = scans.snr()
     #print (intensities[0:10])
     
     # replace frist two pixels with the value of 3rd
     # in OceanView first three values are the same
-    intensities[0] = intensities[1] = intensities[2]
+    with metrics.timer('pixelFixup'):
+      intensities[0] = intensities[1] = intensities[2]
+      std[0] = std[1] = std[2]
+      snr[0] = snr[1] = snr[2]
     
     # perform boxcar averaging
+    if boxcarWidth > 0 and not hardware:
+      with metrics.timer('boxcar'):
+        intensities = boxcar(intensities, boxcarWidth)
+    
+    pixelMask = mask.mask()
     if boxcarWidth > 0:
-      window = boxcarWidth*2 + 1
-      intensities = np.convolve(intensities, np.ones(window), mode='same') / window
+      pixelMask = dilateMask(pixelMask, boxcarWidth)
+    
+    # std and snr describe the unsmoothed average, the device does not
+    # report them
+    if hardware:
+      std[:] = np.nan
+      snr[:] = np.nan
     
     return {
       'xs': self.wavelengths,
-      'ys': intensities
+      'ys': intensities,
+      'std': std,
+      'snr': snr,
+      'mask': pixelMask,
+      'saturated': mask.saturatedScans > 0,
+      'rejected': rejected,
+      'scans': scanCount,
+      'hardwareProcessing': hardware
     }
+
+  # full scale of the device in counts
+  def maxIntensity(self):
+    return getattr(self._sp, 'max_intensity', MAX_COUNTS)
+
+  # Counts subtracted by the electric dark correction, the median difference
+  # of a raw and a corrected scan; measured once per device. A saturated pixel
+  # reads this much below the full scale with the correction on.
+  def electricDarkLevel(self):
+    if self._electricDark is None:
+      with self._lock:
+        raw = np.asarray(self._sp.intensities(False, False), dtype=np.float64)
+        corrected = np.asarray(self._sp.intensities(True, False), dtype=np.float64)
+      self._electricDark = max(float(np.median(raw - corrected)), 0.)
+    return self._electricDark
+
+  # saturation and nonlinearity levels of the pixel mask in the counts read
+  # with or without the electric dark correction
+  def _maskLevels(self, correctDarkCounts):
+    fullScale = self.maxIntensity()
+    offset = self.electricDarkLevel() if correctDarkCounts else 0.
+    return fullScale * SATURATION_FRACTION - offset, fullScale * MAX_INTENSITY / MAX_COUNTS - offset
+
+  def _resetHardwareProcessing(self):
+    # None until the device is asked for the feature
+    self._spectrumProcessing = None
+    # scans and boxcar width currently set on the device
+    self._hardwareSettings = (1, 0)
+
+  # spectrum processing feature (on-board averaging and boxcar) of the
+  # device, False if it does not have one
+  def spectrumProcessingFeature(self):
+    if self._spectrumProcessing is None:
+      try:
+        feature = getattr(self._sp.f, 'spectrum_processing', None)
+      except (AttributeError, SeaBreezeError):
+        feature = None
+      self._spectrumProcessing = feature if feature is not None else False
+    return self._spectrumProcessing
+
+  # sets on-board averaging and boxcar if changed; False if the device can not
+  # do it, then the host does the processing
+  def _setHardwareProcessing(self, scansToAverage, boxcarWidth):
+    if (scansToAverage, boxcarWidth) == self._hardwareSettings:
+      return True
+    
+    feature = self.spectrumProcessingFeature()
+    if not feature:
+      return False
+    
+    try:
+      with self._lock:
+        feature.set_scans_to_average(scansToAverage)
+        feature.set_boxcar_width(boxcarWidth)
+    except SeaBreezeError as e:
+      # out of the device's range, back to plain spectra
+      log.info('hardware processing not possible (%s), averaging on host', e)
+      with self._lock:
+        feature.set_scans_to_average(1)
+        feature.set_boxcar_width(0)
+      self._hardwareSettings = (1, 0)
+      return False
+    
+    self._hardwareSettings = (scansToAverage, boxcarWidth)
+    return True
+
+  # free-run mode: a producer thread reads spectra continuously into a ring
+  # buffer of the last bufferLength frames, read it through continuousBuffer;
+  # a read error stops it and is kept in continuousError
+  def startContinuous(self, bufferLength=100, correctDarkCounts=False, correctNonlinearity=False):
+    if self._continuousThread is not None:
+      self.stopContinuous()
+    
+    # single frames, not averaged on the device
+    self._setHardwareProcessing(1, 0)
+    self.continuousBuffer = SpectrumRingBuffer(bufferLength, len(self.wavelengths))
+    self.continuousError = None
+    self._continuousStop.clear()
+    self._continuousThread = threading.Thread(
+      target=self._runContinuous,
+      args=(correctDarkCounts, correctNonlinearity),
+      daemon=True
+    )
+    self._continuousThread.start()
+    return self.continuousBuffer
+
+  def stopContinuous(self):
+    # the thread clears it itself after an error
+    thread = self._continuousThread
+    if thread is None:
+      return
+    
+    self._continuousStop.set()
+    thread.join()
+    self._continuousThread = None
+
+  def isContinuous(self):
+    return self._continuousThread is not None
+
+  def _runContinuous(self, correctDarkCounts, correctNonlinearity):
+    try:
+      while not self._continuousStop.is_set():
+        with self._lock:
+          frame = self._sp.intensities(correctDarkCounts, correctNonlinearity)
+        frame[0] = frame[1] = frame[2]
+        self.continuousBuffer.write(frame)
+    except Exception as e:
+      # USB error or disconnect, the mode is stopped
+      log.error('free-run mode stopped: %s', e)
+      self.continuousError = e
+      if self._continuousThread is threading.current_thread():
+        self._continuousThread = None
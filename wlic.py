@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Author: Peter Nadrah
+## License: GNU GPL v3
+## Description: Part of WLIC - simple GUI program for collecting spectra from
+##              spectrometer.
+
+## Command line interface.
+## Run: python wlic.py <command> --help
+
+import sys
+import logging
+import argparse
+from batch import *
+
+def batchCommand(args):
+  files = expandFiles(args.files)
+  regions = [parseRegion(region) for region in args.region]
+  toArchive = args.format == 'archive' or (args.format is None and not args.output.lower().endswith('.csv'))
+  # before the output is opened; the files are only read when the results are
+  if args.calibration is not None and args.integration_time is None:
+    args.parser.error('--integration-time is needed with --calibration')
+
+  results = processFiles(
+    files,
+    darkFile=args.dark,
+    boxcarWidth=args.boxcar,
+    regions=regions,
+    calibrationFile=args.calibration,
+    integrationTime=args.integration_time,
+    collectionArea=args.area,
+    keepSpectra=toArchive,
+    workers=args.workers
+  )
+
+  if toArchive:
+    count = writeSummaryArchive(results, regions, args.output, args.calibration is not None)
+  else:
+    count = writeSummaryCsv(results, regions, args.output, args.calibration is not None)
+  print('processed {0} files into {1}'.format(count, args.output))
+
+def kineticsCommand(args):
+  from spcomm import SpComm
+  from kinetics import KineticsRun
+
+  spectrometer = SpComm()
+  if not spectrometer.connectToDevice():
+    print('no spectrometer found')
+    return 1
+
+  run = KineticsRun(
+    spectrometer,
+    args.output,
+    args.interval / 1000,
+    args.integration_time,
+    args.scans,
+    args.boxcar,
+    args.correct_dark,
+    args.correct_nonlinearity,
+    args.duration
+  )
+  report = lambda stats: print('\rframes {frames}, dropped {dropped}, jitter {jitterMean:.4f} +- {jitterStd:.4f} s (max {jitterMax:.4f} s)'.format(**stats), end='')
+  try:
+    stats = run.run(callback=report, resume=not args.restart)
+  except ValueError as e:
+    # an existing archive or different settings
+    print(e)
+    return 1
+  except KeyboardInterrupt:
+    # the run can be resumed by running the same command again
+    stats = run.statistics()
+  print()
+  print(stats)
+  spectrometer.disconnect()
+
+def serveCommand(args):
+  from server import serve
+
+  serve(
+    args.host,
+    None if args.port == 0 else args.port,
+    args.unix_socket,
+    integrationTime=args.integration_time,
+    scansToAverage=args.scans,
+    boxcarWidth=args.boxcar,
+    correctDarkCounts=args.correct_dark,
+    correctNonlinearity=args.correct_nonlinearity
+  )
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog='wlic', description='WaveLength Intensity Collector')
+  commands = parser.add_subparsers(dest='command', required=True)
+
+  batchParser = commands.add_parser('batch', help='process a set of OceanView spectrum files')
+  batchParser.add_argument('files', nargs='+', help='spectrum files or glob patterns')
+  batchParser.add_argument('-d', '--dark', help='dark spectrum file')
+  batchParser.add_argument('-b', '--boxcar', type=int, default=0, help='boxcar width, to the left and right')
+  batchParser.add_argument('-r', '--region', action='append', default=[], metavar='MIN:MAX', help='wavelength region in nm, can be repeated')
+  batchParser.add_argument('-c', '--calibration', help='irradiance calibration file (.IrradCal)')
+  batchParser.add_argument('-t', '--integration-time', type=int, help='integration time in us, needed for irradiance')
+  batchParser.add_argument('-a', '--area', type=float, default=0.40018986, help='collection area in cm^2')
+  batchParser.add_argument('-o', '--output', required=True, help='summary .csv or binary spectrum archive')
+  batchParser.add_argument('-f', '--format', choices=['csv', 'archive'], help='output format, by default from the output extension')
+  batchParser.add_argument('-j', '--workers', type=int, help='number of worker processes, all cores by default')
+  batchParser.set_defaults(run=batchCommand, parser=batchParser)
+
+  kineticsParser = commands.add_parser('kinetics', help='acquire spectra at regular intervals into a spectrum archive')
+  kineticsParser.add_argument('-i', '--interval', type=float, required=True, help='interval between spectra in ms')
+  kineticsParser.add_argument('-t', '--integration-time', type=int, required=True, help='integration time in us')
+  kineticsParser.add_argument('-s', '--scans', type=int, default=1, help='scans to average')
+  kineticsParser.add_argument('-b', '--boxcar', type=int, default=0, help='boxcar width, to the left and right')
+  kineticsParser.add_argument('--correct-dark', action='store_true', help='electric dark correction')
+  kineticsParser.add_argument('--correct-nonlinearity', action='store_true', help='nonlinearity correction')
+  kineticsParser.add_argument('-d', '--duration', type=float, help='duration in s, until interrupted by default')
+  kineticsParser.add_argument('--restart', action='store_true', help='start over instead of resuming an interrupted run, replaces an existing archive')
+  kineticsParser.add_argument('-o', '--output', required=True, help='spectrum archive')
+  kineticsParser.set_defaults(run=kineticsCommand)
+
+  serveParser = commands.add_parser('serve', help='keep the spectrometer open and serve acquisition requests over a socket')
+  serveParser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+  serveParser.add_argument('-p', '--port', type=int, default=7878, help='TCP port, 0 to listen only on the Unix socket')
+  serveParser.add_argument('-u', '--unix-socket', help='path of a Unix socket to listen on')
+  serveParser.add_argument('-t', '--integration-time', type=int, default=100000, help='default integration time in us')
+  serveParser.add_argument('-s', '--scans', type=int, default=1, help='default scans to average')
+  serveParser.add_argument('-b', '--boxcar', type=int, default=0, help='default boxcar width, to the left and right')
+  serveParser.add_argument('--correct-dark', action='store_true', help='electric dark correction by default')
+  serveParser.add_argument('--correct-nonlinearity', action='store_true', help='nonlinearity correction by default')
+  serveParser.set_defaults(run=serveCommand)
+
+  args = parser.parse_args(argv)
+  logging.basicConfig(level=logging.INFO)
+  return args.run(args)
+
+if __name__ == '__main__':
+  sys.exit(main())